@@ -7,10 +7,13 @@ from . import database
 from . import wrappers
 from . import convert
 from . import graph
+from . import cohort
+from . import loader
 from . import skeleton
 from . import bucket
 from . import test_data
 from . import mesh
+from . import sidecar
 from . import anatomist
 from .recipes import *
 from .data_provider import *
@@ -21,3 +21,98 @@ def flip_bucket(bucket, axis=0):
         raise ValueError("Unknown bucket type")
 
     return out
+
+
+class ColumnarBuckets:
+    """A list of buckets stored in columnar (CSR-like) form.
+
+    The points of all the buckets are stored in one contiguous (N,3) array.
+    The points of the i-th bucket are points[offsets[i]:offsets[i+1]].
+    columns is a dictionnary of arrays with one value per bucket
+    (e.g. the names of the graph vertices the buckets come from).
+
+    Example
+    =======
+    '''python
+        cb = ColumnarBuckets.from_list([bck1, bck2], columns={'name': ['S.C._left', 'F.C.M._left']})
+        cb[1]  # points of the second bucket (a view, not a copy)
+        cb.columns['name'][1]
+        cb.save("buckets.npz")
+        cb = ColumnarBuckets.load("buckets.npz")
+    '''
+    """
+
+    def __init__(self, points, offsets, columns=None):
+        self.points = _np.asarray(points)
+        self.offsets = _np.asarray(offsets, dtype=_np.int64)
+        self.columns = {k: _np.asarray(v) for k, v in (columns or {}).items()}
+
+        if self.points.ndim != 2 or self.points.shape[1] != 3:
+            raise ValueError("points must be a (N,3) array")
+        if self.offsets[0] != 0 or self.offsets[-1] != len(self.points):
+            raise ValueError("offsets must start at 0 and end at len(points)")
+        for k, v in self.columns.items():
+            if len(v) != len(self):
+                raise ValueError(
+                    f"column {k} must have one value per bucket")
+
+    @classmethod
+    def from_list(cls, buckets, columns=None, dtype=None):
+        """Build an instance from a list of (N_i,3) arrays.
+
+        columns is a dictionnary of sequences with one value per bucket."""
+        counts = [len(b) for b in buckets]
+        offsets = _np.concatenate([[0], _np.cumsum(counts, dtype=_np.int64)])
+        if len(buckets) > 0:
+            points = _np.concatenate(
+                [_np.asarray(b).reshape(-1, 3) for b in buckets])
+        else:
+            points = _np.empty((0, 3))
+        if dtype is not None:
+            points = points.astype(dtype, copy=False)
+        return cls(points, offsets, columns)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("bucket index out of range")
+        return self.points[self.offsets[i]:self.offsets[i+1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return f"ColumnarBuckets of {len(self)} buckets ({len(self.points)} points)"
+
+    @property
+    def counts(self):
+        """Number of points of each bucket"""
+        return _np.diff(self.offsets)
+
+    def bucket_indices(self):
+        """Return the index of the bucket of each point"""
+        return _np.repeat(_np.arange(len(self)), self.counts)
+
+    def to_list(self):
+        """Return the list of the buckets (views on points)"""
+        return list(self)
+
+    def save(self, path):
+        """Save all the arrays in one uncompressed .npz file"""
+        columns = {"column_" + k: v for k, v in self.columns.items()}
+        _np.savez(path, points=self.points, offsets=self.offsets, **columns)
+
+    @classmethod
+    def load(cls, path, allow_pickle=False):
+        """Load an instance saved with save().
+
+        allow_pickle must be True if some columns contain python objects (e.g. None values)."""
+        with _np.load(path, allow_pickle=allow_pickle) as f:
+            columns = {k[len("column_"):]: f[k]
+                       for k in f.files if k.startswith("column_")}
+            return cls(f['points'], f['offsets'], columns)
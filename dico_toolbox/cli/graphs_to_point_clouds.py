@@ -0,0 +1,60 @@
+# [treesource] dtb_graphs_to_point_clouds
+
+import argparse
+import os
+import dico_toolbox as dtb
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def main(*args, **kwargs):
+    parser = argparse.ArgumentParser(
+        description="Extract the point clouds of the vertices of many graphs and store them "
+                    "in one numpy file, with keys subject/hemisphere/label.")
+    parser.add_argument(
+        "input_path", help="The paths of the graphs (wildcards are admitted e.g. */*.arg)", nargs='*', type=str)
+    parser.add_argument("-o", "--output_path",
+                        help="The path of the output .npz file", type=str, required=True)
+    parser.add_argument("-d", "--database",
+                        help="Use all the graphs of this Brainvisa database instead of input_path", type=str)
+    parser.add_argument("-q", "--query", nargs='*', default=[],
+                        help="Database query as key=value pairs (e.g. graph_session=session1_manual). "
+                             "By default all the labelled graphs are used.")
+    parser.add_argument("-k", "--key", default="name",
+                        help="The vertex property used as label (default: name)")
+    parser.add_argument("-t", "--transform", choices=["Talairach", "ICBM2009c"],
+                        help="Transform the points in this space")
+    parser.add_argument("-b", "--bck_types", nargs='*', default=dtb.graph.BUCKETS_TYPES,
+                        help="The types of buckets to extract")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Number of processes (default: number of CPUs)")
+    args = parser.parse_args()
+
+    out_path = args.output_path
+
+    # create output directories if they do not exist
+    base_out_dir = os.path.dirname(out_path)
+    if base_out_dir:
+        os.makedirs(base_out_dir, exist_ok=True)
+
+    query = dict(q.split("=", 1) for q in args.query)
+    if args.database:
+        graphs = dtb.database.BVDatabase(args.database)
+    else:
+        # check that the wildcard have been expanded
+        for path in args.input_path:
+            if not os.path.exists(path):
+                raise ValueError(f"ERROR: check the input path: {path}")
+        graphs = args.input_path
+
+    keys, errors = dtb.cohort.extract_cohort_buckets(
+        graphs, out_path, key=args.key, transform=args.transform,
+        bck_types=args.bck_types, n_jobs=args.jobs, **query)
+
+    print(f"{len(keys)} point clouds saved in {out_path}")
+
+    if len(errors) > 0:
+        error_str = [f"There were {len(errors)} ERRORS:",
+                     *[f"{path}: {msg}" for path, msg in errors.items()]]
+        log.error("\n".join(error_str))
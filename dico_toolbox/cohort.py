@@ -0,0 +1,157 @@
+# [treesource] cohort-level extraction from many graphs
+import os.path as _op
+import zipfile as _zipfile
+from multiprocessing import Pool as _Pool, cpu_count as _cpu_count
+import numpy as _np
+from tqdm import tqdm as _tqdm
+from soma import aims as _aims
+from . import graph as _graph
+from . import database as _database
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def graph_identifiers(path):
+    """Guess the subject and the hemisphere of a Morphologist graph from its path.
+
+    The subject is the directory above "t1mri" if the path follows the Morphologist
+    layout, otherwise the file name without the hemisphere letter.
+
+    Return a Tuple (subject, hemisphere), hemisphere is "left", "right" or None.
+    """
+    fname = _op.basename(path)
+    fname = fname[:-len(".arg")] if fname.endswith(".arg") else fname
+    hemi = {"L": "left", "R": "right"}.get(fname[:1])
+    parts = _op.normpath(path).split(_op.sep)
+    if "t1mri" in parts[1:]:
+        subject = parts[parts.index("t1mri") - 1]
+    else:
+        subject = fname[1:] if hemi else fname
+    return subject, hemi
+
+
+class _NpzStreamWriter:
+    """Write numpy arrays one by one in an uncompressed .npz file"""
+
+    def __init__(self, path):
+        self._zip = _zipfile.ZipFile(
+            path, mode="w", compression=_zipfile.ZIP_STORED, allowZip64=True)
+        self.keys = []
+
+    def write(self, key, array):
+        with self._zip.open(key + ".npy", mode="w", force_zip64=True) as f:
+            _np.lib.format.write_array(f, _np.asanyarray(array), allow_pickle=False)
+        self.keys.append(key)
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _extract_one_graph(data):
+    """Extract the buckets of one graph, grouped by label.
+    This function is adapted for multiprocessing: only numpy arrays are returned."""
+    try:
+        graph = _aims.read(data['path'])
+        buckets, labels = _graph.list_buckets(
+            graph, data['key'], data['needed_values'], return_keys=data['key'],
+            transform=data['transform'], bck_types=data['bck_types'])
+        grouped = {}
+        for bck, label in zip(buckets, labels):
+            grouped.setdefault(str(label), []).append(bck)
+        buckets = {label: _np.vstack(bcks).astype(data['dtype'])
+                   for label, bcks in grouped.items()}
+        error = None
+    except Exception as e:
+        buckets = None
+        error = str(e)
+    return dict(data, buckets=buckets, error=error)
+
+
+def extract_cohort_buckets(graphs, output_path, key='name', needed_values=None, transform=None,
+                           bck_types=_graph.BUCKETS_TYPES, n_jobs=None, dtype=_np.float32, **query):
+    """Extract the buckets of many graphs in parallel and store them in one .npz file.
+
+    The buckets of the vertices of each graph are grouped by the value of key
+    (e.g. the sulcus name) and stored as soon as they are extracted, under the
+    name "subject/hemisphere/label".
+
+    Args:
+        graphs (list of str | database.BVDatabase): the paths of the graphs, or a database.
+        output_path (str): the path of the output .npz file (uncompressed).
+        key (str, optional): the vertex property used to group the buckets. Defaults to 'name'.
+        needed_values (list, optional): extract only the vertices whose key has one of these values.
+        transform ("ICBM2009c" | "Talairach" | None, optional): see graph.list_buckets().
+        bck_types (list of str, optional): see graph.list_buckets().
+        n_jobs (int, optional): number of processes. Defaults to the number of CPUs.
+        dtype (optional): data type of the stored points. Defaults to numpy.float32.
+
+        If graphs is a database, the other keyword arguments are used to query the graphs
+        (e.g. subject=['001', '002'], hemisphere='left', graph_session='session1_manual').
+        By default only the labelled graphs (that have a graph_session) are extracted.
+
+        Only one graph is stored per subject and hemisphere: if several graphs match
+        (e.g. several sessions), the first one in the order of the paths is stored
+        and the others are reported in the errors.
+
+    Returns:
+        Tuple (keys, errors): the list of the keys stored in the output file
+        and a dictionnary {graph path: error message}.
+
+    Example
+    =======
+    '''python
+        db = BVDatabase("/path/to/the/database")
+        keys, errors = extract_cohort_buckets(db, "buckets.npz", transform="Talairach", graph_session="session1_manual")
+        buckets = numpy.load("buckets.npz")
+        buckets["001/left/S.C._left"]
+    '''
+    """
+    if isinstance(graphs, _database.FileDatabase):
+        db = graphs
+        # the unlabelled graphs have no session
+        query.setdefault('graph_session', [])
+        paths = sorted(db.get(type="graph", **query))
+        attributes = [db.get_attribute_of(p) for p in paths]
+        identifiers = [(a.get('subject'), a.get('hemisphere')) for a in attributes]
+    else:
+        if len(query) > 0:
+            raise ValueError("Queries can only be used with a database.")
+        paths = list(graphs)
+        identifiers = [graph_identifiers(p) for p in paths]
+
+    data = [dict(path=path, subject=subject, hemisphere=hemi, key=key,
+                 needed_values=needed_values, transform=transform,
+                 bck_types=bck_types, dtype=dtype)
+            for path, (subject, hemi) in zip(paths, identifiers)]
+
+    if n_jobs is None:
+        n_jobs = _cpu_count()
+
+    errors = {}
+    prefixes = set()
+    with _NpzStreamWriter(output_path) as writer, _Pool(max(1, n_jobs)) as pool:
+        # the results are received in order, so that duplicates are resolved deterministically
+        for res in _tqdm(pool.imap(_extract_one_graph, data),
+                         total=len(data), desc="extracting buckets"):
+            if res['error'] is not None:
+                errors[res['path']] = res['error']
+                continue
+            prefix = f"{res['subject']}/{res['hemisphere']}/"
+            if prefix in prefixes:
+                errors[res['path']] = f"Duplicate subject/hemisphere: {prefix}"
+                continue
+            prefixes.add(prefix)
+            for label, bck in res['buckets'].items():
+                writer.write(prefix + label, bck)
+
+    if len(errors) > 0:
+        log.error(f"{len(errors)} graph(s) could not be extracted.")
+
+    return writer.keys, errors
@@ -3,6 +3,7 @@
 from . import bucket as _bucket
 from . import mesh as _mesh
 from . import transform as _transform
+from .wrappers import PyMesh as _PyMesh
 import os
 import tempfile
 from soma import aims as _aims
@@ -12,6 +13,7 @@ from scipy import ndimage as _ndimage
 
 import numpy as np
 import shutil as _shutil
+from multiprocessing import Pool as _Pool, cpu_count as _cpu_count
 import logging
 from ._dev import _deprecation_alert_decorator
 log = logging.getLogger(__name__)
@@ -33,7 +35,7 @@ def ndarray_to_volume_aims(ndarray):
     return _aims.Volume(np.asfortranarray(ndarray))
 
 
-def bucketMAP_aims_to_ndarray(bck_map, scaled=True):
+def bucketMAP_aims_to_ndarray(bck_map, scaled=True, dtype=np.float64):
     """Transform the first element of an aims bucket MAP into numpy array.
     NOTE: Unless scaled=True, the voxel size stored in the bucket's header
           is not taken into considesation here. The unscaled coordinates are returned.
@@ -41,6 +43,7 @@ def bucketMAP_aims_to_ndarray(bck_map, scaled=True):
     :param bck_map: aims bucket MAP
     :type aims_bucket: soma.aims.BucketMap_VOID
     :param scaled: if True the coordinates are scaled according to the voxel size.
+    :param dtype: data type of the returned array (see bucket_aims_to_ndarray)
     :return: bool
     :rtype: numpy.ndarray
     """
@@ -52,14 +55,50 @@ def bucketMAP_aims_to_ndarray(bck_map, scaled=True):
     else:
         dxyz = np.ones(3)
 
-    return bucket_aims_to_ndarray(bck_map[0], voxel_size=dxyz)
+    return bucket_aims_to_ndarray(bck_map[0], voxel_size=dxyz, dtype=dtype)
 
 
-def bucket_aims_to_ndarray(aims_bucket, voxel_size=(1, 1, 1)):
+# buckets smaller than this are copied point by point: rasterizing them
+# in a whole volume would cost more than the copy
+_BULK_KEYS_MIN_POINTS = 10000
+
+
+def _bucket_keys_to_ndarray(aims_bucket):
+    """Copy the keys (voxel indices) of an aims bucket into a (N,3) int array,
+    in the order of the bucket (sorted by z, y then x).
+
+    Large buckets are rasterized in C++ by the AIMS bucket to volume Converter
+    and the voxels are found by np.argwhere, so that no python object is created
+    per point. Small buckets, and the buckets that the Converter can not
+    rasterize entirely (e.g. negative coordinates), are copied point by point.
+    """
+    n_points = aims_bucket.size()
+    if n_points >= _BULK_KEYS_MIN_POINTS:
+        bck_map = _aims.BucketMap_VOID()
+        bck_map[0] = aims_bucket
+        vol = bucketMap_aims_to_rc_ptr_Volume_aims(bck_map).get()
+        # the transposed volume lists the voxels in the order of the keys
+        keys = np.argwhere(volume_to_ndarray(vol).T)[:, ::-1]
+        if len(keys) == n_points:
+            return keys.astype(np.int32, copy=False)
+        log.debug("The bucket is not entirely in the converted volume: "
+                  "the points are copied one by one.")
+    keys = np.array([p.arraydata() for p in aims_bucket.keys()], dtype=np.int32)
+    return keys.reshape(-1, 3)
+
+
+def bucket_aims_to_ndarray(aims_bucket, voxel_size=(1, 1, 1), dtype=np.float64):
     """Transform an aims bucket into numpy array.
 
+    The voxel indices are extracted in bulk and the voxel size is applied
+    once to the whole (N,3) array.
+
     :param aims_bucket: aims bucket object
     :type aims_bucket: soma.aims.BucketMap_VOID.Bucket
+    :param voxel_size: the coordinates are multiplied by these factors.
+    :param dtype: data type of the returned array (e.g. np.float32 or np.int16
+        for a more compact output). Integer types should only be used with
+        unscaled coordinates or integer voxel sizes, as the values are truncated.
     :rtype: numpy.ndarray
     """
 
@@ -67,38 +106,82 @@ def bucket_aims_to_ndarray(aims_bucket, voxel_size=(1, 1, 1)):
         raise ValueError("The argument is a BucketMap.")
 
     assert isinstance(aims_bucket, _aims.BucketMap_VOID.Bucket)
-    voxel_size = np.array(voxel_size)
+    voxel_size = np.asarray(voxel_size, dtype=np.float64)
 
     if aims_bucket.size() > 0:
-        v = np.empty((aims_bucket.size(), len(aims_bucket.keys()[0].list())))
-        for i, point in enumerate(aims_bucket.keys()):
-            v[i] = point.arraydata()*voxel_size
+        v = _bucket_keys_to_ndarray(aims_bucket)
+        if not np.all(voxel_size == 1):
+            v = v * voxel_size
+        v = v.astype(dtype, copy=False)
     else:
         log.debug("Empty bucket! This can be a source of problems...")
-        v = np.empty(0)
+        v = np.empty(0, dtype=dtype)
     return v
 
 
+# The volume rasterized to build a bucket in bulk starts at the origin:
+# it is only used if it has at most max(_BULK_BUCKET_MIN_VOXELS, _BULK_BUCKET_VOXELS_PER_POINT * N) voxels
+_BULK_BUCKET_MIN_VOXELS = 256**3
+_BULK_BUCKET_VOXELS_PER_POINT = 64
+
+
+def _bucketMap_aims_from_positive_ndarray(ndarray, voxel_size):
+    """Build an aims BucketMap_VOID from a (N,3) array of non-negative int coordinates.
+
+    The points are rasterized in an aims volume which is then converted
+    into a bucket by the AIMS Converter, so that the bucket is filled in C++
+    in one go. The volume starts at the origin, so that the voxel indices
+    are the bucket coordinates.
+    """
+    vol = _aims.Volume(*(ndarray.max(axis=0) + 1), dtype='int16')
+    vol.fill(0)
+    vol.header()['voxel_size'] = list(voxel_size) + [1]
+    _rasterize_numpy_bucket(ndarray, volume_to_ndarray(vol), (0, 0, 0))
+
+    c = _aims.Converter(intype=vol, outtype=_aims.BucketMap_VOID)
+    return c(vol)
+
+
+def _can_build_bucket_in_bulk(ndarray):
+    """Return True if the points can be rasterized in a volume starting at the origin,
+    i.e. they are non-negative and the volume is not too big for their number."""
+    if len(ndarray) == 0 or ndarray.min() < 0:
+        return False
+    n_voxels = np.prod(ndarray.max(axis=0) + 1, dtype=np.float64)
+    return n_voxels <= max(_BULK_BUCKET_MIN_VOXELS, _BULK_BUCKET_VOXELS_PER_POINT * len(ndarray))
+
+
 def bucket_numpy_to_bucketMap_aims(ndarray, voxel_size=(1, 1, 1)):
     """Transform a (N,3) ndarray into an aims BucketMap_VOID.
     The coordinates in the input array are casted to int.
-    """
 
-    # TODO: set the voxel_size in the aims bucket
+    When all the coordinates are non-negative (e.g. the points of a volume),
+    the bucket is built in bulk by the AIMS volume to bucket Converter.
+    This needs a volume from the origin to the farthest point: if the coordinates
+    are negative, or if this volume is much bigger than the number of points
+    (e.g. a few points far from the origin), the points are inserted one by one.
+    """
 
     assert ndarray.shape[1] == 3, " ndarray shape must be (N,3)"
 
     if ndarray.dtype != int:
         ndarray = ndarray.astype(int)
 
-    # create aims bucketmap instance
-    bck_map = _aims.BucketMap_VOID()
-    bck_map.setSizeXYZT(*voxel_size, 1)
-    b0 = bck_map[0]
+    voxel_size = [float(x) for x in voxel_size[:3]]
+
+    if _can_build_bucket_in_bulk(ndarray):
+        bck_map = _bucketMap_aims_from_positive_ndarray(ndarray, voxel_size)
+    else:
+        # create aims bucketmap instance
+        bck_map = _aims.BucketMap_VOID()
+        b0 = bck_map[0]
+
+        # fill the bucket
+        for x, y, z in ndarray:
+            b0[x, y, z] = 1
 
-    # fill the bucket
-    for x, y, z in ndarray:
-        b0[x, y, z] = 1
+    bck_map.setSizeXYZT(*voxel_size, 1)
+    bck_map.header()['voxel_size'] = voxel_size + [1]
 
     return bck_map
 
@@ -130,15 +213,18 @@ def volume_to_ndarray(volume):
     return volume[:]
 
 
-def _volume_size_from_numpy_bucket(bucket_array, pad):
+def _volume_size_from_numpy_bucket(bucket_array, pad, tight=False):
     a = bucket_array
-    # the minimum and maximum here make sure that the voxels
-    # are in the absolute coordinates system of the bucket
-    # i.e. the volume always include the bucket origin.
-    # This is the behaviour of AIMS
-    # this also makes the volume bigger and full with zeros
-    v_max = np.maximum((0, 0, 0), a.max(axis=0))
-    v_min = np.minimum((0, 0, 0), a.min(axis=0))
+    v_max = a.max(axis=0)
+    v_min = a.min(axis=0)
+    if not tight:
+        # the minimum and maximum here make sure that the voxels
+        # are in the absolute coordinates system of the bucket
+        # i.e. the volume always include the bucket origin.
+        # This is the behaviour of AIMS
+        # this also makes the volume bigger and full with zeros
+        v_max = np.maximum((0, 0, 0), v_max)
+        v_min = np.minimum((0, 0, 0), v_min)
     v_size = np.ceil(abs(v_max - v_min) + 1 + pad*2).astype(int)
     return v_size, v_min
 
@@ -155,38 +241,80 @@ def _point_to_voxel_indices(point):
     return np.round(point).astype(int)
 
 
-def bucket_numpy_to_volume_numpy(bucket_array, pad=0, side=None):
+def _rasterize_numpy_bucket(bucket_array, volume, offset, pad=0, value=1):
+    """Write value in volume at the position of all the points of the bucket.
+
+    The whole (N,3) array is rounded and shifted at once, then written
+    into the volume with a single fancy-indexing assignment.
+
+    Args:
+        bucket_array (numpy.ndarray): (N,3) points coordinates
+        volume (numpy.ndarray): 3D array modified in place
+        offset (Sequence[numeric]): coordinates of the volume origin
+        pad (int, optional): padding of the volume. Defaults to 0.
+        value (scalar or numpy.ndarray, optional): value written in the voxels,
+            it can be an array of N values (one per point). Defaults to 1.
+
+    Returns:
+        numpy.ndarray: the modified volume
+    """
+    indices = _point_to_voxel_indices(
+        np.asarray(bucket_array) - offset + pad)
+    volume[indices[:, 0], indices[:, 1], indices[:, 2]] = value
+    return volume
+
+
+def bucket_numpy_to_volume_numpy(bucket_array, pad=0, side=None, dtype=np.float64, tight=False):
     """Transform a bucket into a 3d boolean volume.
     Input and output types are numpy.ndarray
 
+    The dtype of the volume can be chosen (e.g. bool, np.uint8 or np.int16)
+    to reduce the memory footprint. The default is np.float64.
+
+    By default the volume includes the origin of the bucket coordinates
+    system (AIMS behaviour). If tight is True, only the bounding box of the
+    bucket (plus the padding) is allocated.
+
     Return: a Tuple (volume, offset)
-    the offset is a vector specifing the position of the origin in the volume
+    the offset is a vector specifing the position of the origin in the volume,
+    i.e. the point p is in the voxel p - offset + pad.
     """
 
-    v_size, offset = _volume_size_from_numpy_bucket(bucket_array, pad)
-
-    vol = np.zeros(np.array(v_size))
+    v_size, offset = _volume_size_from_numpy_bucket(
+        bucket_array, pad, tight=tight)
 
-    for p in bucket_array:
-        x, y, z = _point_to_voxel_indices((p-offset)+pad)
-        vol[x, y, z] = 1
+    vol = np.zeros(np.array(v_size), dtype=dtype)
+    _rasterize_numpy_bucket(bucket_array, vol, offset, pad)
 
     return vol, offset
 
 
-def bucket_numpy_to_volume_aims(bucket_array, pad=0):
-    """Transform a bucket into a 3d binary volume."""
+def bucket_numpy_to_volume_aims(bucket_array, pad=0, dtype='int16'):
+    """Transform a bucket into a 3d binary volume.
+
+    dtype is the data type of the aims volume (e.g. 'int16' or 'uint8')
+    The volume includes the origin of the bucket coordinates system."""
 
     v_size, v_min = _volume_size_from_numpy_bucket(bucket_array, pad)
+    return _bucket_numpy_to_volume_aims(bucket_array, v_size, v_min, pad, dtype)
 
-    vol = _aims.Volume(*v_size, dtype='int16')
-    vol.fill(0)
-    avol = volume_to_ndarray(vol)
 
-    for p in bucket_array:
-        x, y, z = _point_to_voxel_indices(p-v_min+pad)
-        avol[x, y, z] = 1
+def bucket_numpy_to_tight_volume_aims(bucket_array, pad=0, dtype='int16'):
+    """Transform a bucket into a 3d binary volume covering only its bounding box (plus the padding).
 
+    Return a Tuple (volume, offset), as bucket_numpy_to_volume_numpy(..., tight=True):
+    the point p of the bucket is in the voxel p - offset + pad."""
+
+    v_size, v_min = _volume_size_from_numpy_bucket(
+        bucket_array, pad, tight=True)
+    return _bucket_numpy_to_volume_aims(bucket_array, v_size, v_min, pad, dtype), v_min
+
+
+def _bucket_numpy_to_volume_aims(bucket_array, v_size, v_min, pad, dtype):
+    vol = _aims.Volume(*v_size, dtype=dtype)
+    vol.fill(0)
+    avol = volume_to_ndarray(vol)
+    _rasterize_numpy_bucket(bucket_array, avol, v_min, pad)
     return vol
 
 
@@ -264,110 +392,534 @@ def add_border(x, thickness, value):
     return x
 
 
-def volume_to_mesh(vol, gblur_sigma=1, threshold="80%",
-                   deciMaxError=1.0, deciMaxClearance=3.0,
-                   deciReductionRate=99, smoothRate=0.4,
-                   smoothIt=30, translation=(0, 0, 0)):
-    """
-    Calculate the mesh of the given volume with pyAims.
+MAX_VOXEL_VALUE = 1000
 
-    Args:
-        volume (nparray or aims Volume): The input volume.
-        gblur_sigma (float, optional): Standard deviation of the 3D isomorph Gaussian filter of the input volume.
-        threshold (float or str) : First threshold value. All voxels below this value are not considered.
-            The threshold can be expressed as:
-            - a float in [0,1], representing the normalized threshold intensity
-            - a percentage (e.g. "95%") which represents the percentile of low-value pixel to eliminate.
-        deciMaxError (float) : Maximum error distance from the original mesh (mm).
-        deciMaxClearance (float) : Maximum clearance of the decimation.
-        smoothIt (int) : Number of mesh smoothing iteration.
-        translation (vector or 3 int) : translation to apply to the calculated mesh
 
+def _gaussian_radius(gblur_sigma):
+    """Radius (in voxels) of the kernel used by scipy.ndimage.gaussian_filter"""
+    return int(4.0*gblur_sigma + 0.5)
 
-    Return aims.Mesh
-    """
 
-    # transform aims.Volume into numpy
-    vol = vol[:]
+def _bounding_box_slices(vol, margin=0):
+    """Return the slices of the bounding box of the non-zero voxels of vol,
+    enlarged by margin voxels on each side and clipped to the volume.
+
+    Return None if the volume is empty.
+    """
+    slices = []
+    for axis in range(3):
+        other_axes = tuple(a for a in range(3) if a != axis)
+        nonzero = np.flatnonzero(np.any(vol, axis=other_axes))
+        if len(nonzero) == 0:
+            return None
+        start = max(nonzero[0] - margin, 0)
+        stop = min(nonzero[-1] + 1 + margin, vol.shape[axis])
+        slices.append(slice(start, stop))
+    return tuple(slices)
+
+
+def _histogram_percentile(field, q, bins=MAX_VOXEL_VALUE):
+    """Return the q-th percentile of the non-zero values of field, as np.percentile().
+
+    field must be normalized in [0,1]. The values are counted in a histogram
+    to find the bins of the two values around the percentile, then only the
+    values of these bins are sorted, instead of all the non-zero values.
+    The percentile is interpolated between these two values, as in np.percentile().
+    """
+    hist, edges = np.histogram(field, bins=bins, range=(0, 1))
+    # remove the zeros from the first bin
+    hist[0] -= field.size - np.count_nonzero(field)
+    cumulated = np.cumsum(hist)
+    n = cumulated[-1]
+    if n == 0:
+        return 0.
+
+    # ranks of the values around the percentile (linear interpolation)
+    position = (n - 1) * (q / 100)
+    rank_low = int(np.floor(position))
+    rank_high = min(rank_low + 1, n - 1)
+    gamma = float(position - rank_low)
+
+    # bins containing these ranks, and number of values before them
+    bin_low, bin_high = np.searchsorted(cumulated, [rank_low, rank_high], side='right')
+    n_before = cumulated[bin_low - 1] if bin_low > 0 else 0
+    # a bin contains [edges[k], edges[k+1]), the last one also contains 1
+    mask = (field >= edges[bin_low]) & (field > 0)
+    if bin_high < bins - 1:
+        mask &= field < edges[bin_high + 1]
+    values = np.sort(field[mask])
+    low = values[rank_low - n_before]
+    high = values[rank_high - n_before]
+
+    # same interpolation as np.percentile()
+    diff = high - low
+    if gamma >= 0.5:
+        return high - diff * (1 - gamma)
+    return low + diff * gamma
+
+
+def _blur_and_normalize(vol, gblur_sigma, low_memory=False):
+    """Blur the volume with a gaussian filter and normalize it in [0,1].
+
+    If low_memory is True, the volume is first cropped to the bounding box
+    of the object, with a margin wide enough for the gaussian kernel, and the
+    computation is done in float32.
+
+    Return a Tuple (normalized_volume, offset) where offset is the position
+    of the returned volume in the input volume.
+    """
+    offset = np.zeros(3, dtype=int)
+    if low_memory:
+        roi = _bounding_box_slices(vol, margin=_gaussian_radius(gblur_sigma)+1)
+        if roi is not None:
+            vol = vol[roi]
+            offset = np.array([s.start for s in roi])
+        dtype = np.float32
+    else:
+        dtype = np.float64
 
-    assert len(vol.shape) == 3
     # convert to float
-    vol = vol.astype(np.float64)
+    vol = vol.astype(dtype)
 
     # === GBLUR ===
-    gblur = _ndimage.gaussian_filter(vol, gblur_sigma, mode='constant', cval=0)
+    gblur = _ndimage.gaussian_filter(
+        vol, gblur_sigma, output=dtype, mode='constant', cval=0)
 
     # === NORMALIZE ===
-    gblur = (gblur - gblur.min())/(gblur.max() - gblur.min())
+    gblur -= gblur.min()
+    gblur /= gblur.max()
 
-    # === THRESHOLD ===
-    nonzero_voxels = gblur[gblur > 0].flatten()
+    return gblur, offset
+
+
+def _threshold_value(gblur, threshold, low_memory=False):
+    """Return the normalized threshold value, in [0,1].
+
+    threshold is either a float in [0,1] or a percentage (e.g. "95%")
+    of the non-zero voxels of gblur."""
     if type(threshold) == str:
         # the threshold is a string
         if threshold[-1] == '%':
             # use the percentage value
             q = float(threshold[:-1])
-            threshold = np.percentile(nonzero_voxels, q)
+            if low_memory:
+                threshold = _histogram_percentile(gblur, q)
+            else:
+                nonzero_voxels = gblur[gblur > 0].flatten()
+                threshold = np.percentile(nonzero_voxels, q)
         else:
             raise ValueError(
                 "aimsThreshold must be a float or a string expressing a percentage (eg '90%')")
+    return threshold
+
+
+def _threshold_volume(gblur, threshold, low_memory=False):
+    """Binarize the normalized volume gblur with aims.
+
+    gblur is rescaled in place to [0, MAX_VOXEL_VALUE].
 
-    MAX_VOXEL_VALUE = 1000
+    Return the thresholded aims.Volume_S16
+    """
+    threshold = _threshold_value(gblur, threshold, low_memory)
     threshold *= MAX_VOXEL_VALUE
 
-    vol_16 = _aims.Volume_S16((MAX_VOXEL_VALUE*gblur).astype(np.int16))
+    gblur *= MAX_VOXEL_VALUE
+    vol_16 = _aims.Volume_S16(gblur.astype(np.int16))
     thresholder = _aims.AimsThreshold(
         _aims.AIMS_GREATER_OR_EQUAL_TO, np.int16(threshold), dtype=vol_16)
-    thresh_vol = thresholder.bin(vol_16)
 
     # NOTE: I could not make the mesher work when tresholding with python
     # gblur *= MAX_VOXEL_VALUE
     # thresh_vol = np.array( gblur[gblur>threshold], dtype=np.int16, order='F')
     # thresh_vol = _aims.Volume_S16(thresh_vol)
+    return thresholder.bin(vol_16)
 
-    # === MESH ===
+
+def _get_mesher(deciReductionRate=None, deciMaxClearance=None, deciMaxError=None,
+                smoothRate=None, smoothIt=None):
+    """Return an aimsalgo.Mesher.
+    The decimation (resp. smoothing) is set only if its parameters are given."""
     m = _aimsalgo.Mesher()
-    m.setDecimation(
-        # deciReductionRate
-        deciReductionRate,
-        # deciMaxClearance
-        deciMaxClearance,
-        # deciMaxError
-        deciMaxError,
-        # deciFeatureAngle
-        180)
-    m.setSmoothing(
-        # smoothType
-        0,
-        # nIteration
-        smoothIt,
-        # smoothRate
-        smoothRate)
+    if deciReductionRate is not None:
+        m.setDecimation(
+            # deciReductionRate
+            deciReductionRate,
+            # deciMaxClearance
+            deciMaxClearance,
+            # deciMaxError
+            deciMaxError,
+            # deciFeatureAngle
+            180)
+    if smoothIt is not None:
+        m.setSmoothing(
+            # smoothType
+            0,
+            # nIteration
+            smoothIt,
+            # smoothRate
+            smoothRate)
+    return m
+
+
+def _join_mesher_output(mesh_dict):
+    """Join all the meshes returned by Mesher.doit() into one mesh"""
+    mesh_dict_reduced = {k: _mesh.join_meshes(v) for k, v in mesh_dict.items()}
+    return _mesh.join_meshes(list(mesh_dict_reduced.values()))
+
+
+def _translate_mesh(mesh, translation):
+    """Return the mesh shifted by translation (or the mesh itself for a null translation)"""
+    if any(np.array(translation) != 0):
+        mesh = _mesh.shift_aims_mesh(
+            mesh, translation, scale=1)
+    return mesh
+
+
+# offsets of the 4 cells around an edge, in the order of the quad
+_QUAD_CELLS = ((1, 1), (0, 1), (0, 0), (1, 0))
+
+
+def _surface_nets(field, level):
+    """Extract the isosurface of a 3D scalar field at the given level.
+
+    This is a vectorized implementation of the (naive) surface nets algorithm:
+    each cube of 8 voxels crossed by the isosurface gets one vertex, placed
+    at the mean of the crossing points of its edges, and each voxel edge
+    crossed by the isosurface gives a quad joining the vertices of the 4
+    cubes around it. The quads are split into triangles oriented outward,
+    i.e. toward the voxels below level.
+
+    Args:
+        field (numpy.ndarray): 3D scalar field
+        level (float): the isosurface value. Voxels >= level are inside.
+
+    Returns:
+        Tuple (vertices, polygons) of (N,3) float and (M,3) int arrays.
+        The vertices are in voxel coordinates.
+    """
+    # pad with outside values so that the surface is closed
+    f = np.pad(field, 1, mode='constant',
+               constant_values=min(field.min(), level) - 1)
+    inside = f >= level
+    cells_shape = tuple(np.array(f.shape) - 1)
+
+    cells = []
+    points = []
+    quads = []
+    for axis in range(3):
+        u, v = (axis+1) % 3, (axis+2) % 3
+        start = [slice(None)]*3
+        stop = [slice(None)]*3
+        start[axis] = slice(0, -1)
+        stop[axis] = slice(1, None)
+        crossing_edges = np.argwhere(
+            inside[tuple(start)] != inside[tuple(stop)])
+
+        # position of the crossing along the edge
+        f0 = f[tuple(crossing_edges.T)]
+        end = crossing_edges.copy()
+        end[:, axis] += 1
+        f1 = f[tuple(end.T)]
+        crossing_points = crossing_edges.astype(float)
+        crossing_points[:, axis] += (level - f0)/(f1 - f0)
+
+        # the cells around each edge
+        edge_cells = []
+        for du, dv in _QUAD_CELLS:
+            c = crossing_edges.copy()
+            c[:, u] -= du
+            c[:, v] -= dv
+            edge_cells.append(np.ravel_multi_index(c.T, cells_shape))
+            cells.append(edge_cells[-1])
+            points.append(crossing_points)
+        edge_cells = np.stack(edge_cells, axis=1)
+
+        # orient the quads outward
+        flip = ~inside[tuple(crossing_edges.T)]
+        edge_cells[flip] = edge_cells[flip, ::-1]
+        quads.append(edge_cells)
+
+    if sum(len(q) for q in quads) == 0:
+        return np.empty((0, 3)), np.empty((0, 3), dtype=int)
+
+    cells = np.concatenate(cells)
+    points = np.concatenate(points)
+    quads = np.concatenate(quads)
+
+    # one vertex per cell, at the mean of the crossing points
+    active_cells, vertex_ids = np.unique(cells, return_inverse=True)
+    counts = np.bincount(vertex_ids)
+    vertices = np.stack([np.bincount(vertex_ids, weights=points[:, i])/counts
+                         for i in range(3)], axis=1)
+    # remove the padding
+    vertices -= 1
+
+    quads = np.searchsorted(active_cells, quads)
+    polygons = np.vstack([quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]])
+    return vertices, polygons
+
+
+def _volume_to_pymesh(gblur, threshold, smoothRate, smoothIt, translation):
+    """Mesh a normalized volume with numpy (see volume_to_mesh)"""
+    vertices, polygons = _surface_nets(gblur, threshold)
+    if smoothIt > 0 and len(polygons) > 0:
+        smoother = _mesh.LaplacianSmoother(polygons, len(vertices))
+        vertices = smoother(vertices, smoothIt, smoothRate)
+    vertices = vertices + np.asarray(translation).reshape(1, 3)
+
+    mesh = _PyMesh()
+    mesh.from_elements(vertices, polygons,
+                       _mesh.compute_normals(vertices, polygons))
+    return mesh
+
+
+def volume_to_mesh(vol, gblur_sigma=1, threshold="80%",
+                   deciMaxError=1.0, deciMaxClearance=3.0,
+                   deciReductionRate=99, smoothRate=0.4,
+                   smoothIt=30, translation=(0, 0, 0), low_memory=False,
+                   backend="aims"):
+    """
+    Calculate the mesh of the given volume with pyAims.
 
+    Args:
+        volume (nparray or aims Volume): The input volume.
+        gblur_sigma (float, optional): Standard deviation of the 3D isomorph Gaussian filter of the input volume.
+        threshold (float or str) : First threshold value. All voxels below this value are not considered.
+            The threshold can be expressed as:
+            - a float in [0,1], representing the normalized threshold intensity
+            - a percentage (e.g. "95%") which represents the percentile of low-value pixel to eliminate.
+        deciMaxError (float) : Maximum error distance from the original mesh (mm).
+        deciMaxClearance (float) : Maximum clearance of the decimation.
+        smoothIt (int) : Number of mesh smoothing iteration.
+        translation (vector or 3 int) : translation to apply to the calculated mesh
+        low_memory (bool) : if True, the volume is cropped to the bounding box of the object
+            (plus a margin for the gaussian blur), the computation is done in float32 and
+            the percentile threshold is estimated from a histogram. Defaults to False.
+        backend ("aims" or "numpy") : with "aims" the mesh is calculated by aimsalgo.Mesher.
+            With "numpy", the isosurface of the blurred volume at the threshold value is
+            extracted with numpy (surface nets) and smoothed with a Laplacian filter.
+            No decimation is done and the result is a wrappers.PyMesh. Defaults to "aims".
+
+
+    Return aims.Mesh (or wrappers.PyMesh with the numpy backend)
+    """
+
+    if backend not in ("aims", "numpy"):
+        raise ValueError(f"Unknown meshing backend: {backend}")
+
+    # transform aims.Volume into numpy
+    vol = vol[:]
+
+    assert len(vol.shape) == 3
+
+    # === GBLUR AND NORMALIZE ===
+    gblur, offset = _blur_and_normalize(vol, gblur_sigma, low_memory)
+
+    if backend == "numpy":
+        assert len(translation) == 3, "len(translation) must be 3"
+        threshold = _threshold_value(gblur, threshold, low_memory)
+        return _volume_to_pymesh(gblur, threshold, smoothRate, smoothIt,
+                                 np.add(translation, offset))
+
+    # === THRESHOLD ===
+    thresh_vol = _threshold_volume(gblur, threshold, low_memory)
+    del gblur
+
+    # === MESH ===
+    m = _get_mesher(deciReductionRate, deciMaxClearance, deciMaxError,
+                    smoothRate, smoothIt)
     mesh_dict = m.doit(thresh_vol)
 
     # === JOIN MESHES ===
-    mesh_dict_reduced = {k: _mesh.join_meshes(v) for k, v in mesh_dict.items()}
-    mesh = _mesh.join_meshes(list(mesh_dict_reduced.values()))
+    mesh = _join_mesher_output(mesh_dict)
 
     # === TRANSLATION ===
     assert len(translation) == 3, "len(translation) must be 3"
-    if any(np.array(translation) != 0):
-        mesh = _mesh.shift_aims_mesh(
-            mesh, translation, scale=1)
+    # the volume might have been cropped
+    return _translate_mesh(mesh, np.add(translation, offset))
 
-    return mesh
+
+class MeshingPipeline:
+    """Mesh a volume in explicit stages and keep the intermediate results.
+
+    The stages are the same as in volume_to_mesh():
+    1. blurred: gaussian blur and normalization (depends on gblur_sigma)
+    2. thresholded: binary aims volume (depends on gblur_sigma and threshold)
+    3. raw_mesh: mesh of the thresholded volume, before smoothing and decimation
+    4. mesh: smoothed and decimated copy of the raw mesh
+
+    The result of each of the first three stages is memoized for the input volume,
+    keyed on the parameters of the stages it depends on. For instance, changing
+    only smoothIt does not recompute the blur, the threshold or the raw mesh.
+
+    NOTE: here the smoothing and the decimation are applied to the joined raw mesh,
+    whereas volume_to_mesh() lets the Mesher apply them to each sub-mesh.
+    The results can be slightly different.
+
+    Example
+    =======
+    '''python
+        pipeline = MeshingPipeline(vol)
+        meshes = [pipeline.mesh(smoothIt=it) for it in range(10, 100, 10)]
+    '''
+    """
+
+    def __init__(self, vol, low_memory=False):
+        """
+        Args:
+            vol (nparray or aims Volume): The input volume.
+            low_memory (bool, optional): see volume_to_mesh(). Defaults to False.
+        """
+        # transform aims.Volume into numpy
+        self.vol = vol[:]
+        assert len(self.vol.shape) == 3
+        self.low_memory = low_memory
+        self.clear()
+
+    def clear(self):
+        """Remove all the memoized intermediate results."""
+        self._blurred = {}
+        self._thresholded = {}
+        self._raw_meshes = {}
+
+    def blurred(self, gblur_sigma=1):
+        """Return a Tuple (normalized blurred volume, offset).
+        The returned volume is shared with the cache and must not be modified."""
+        key = gblur_sigma
+        if key not in self._blurred:
+            self._blurred[key] = _blur_and_normalize(
+                self.vol, gblur_sigma, self.low_memory)
+        return self._blurred[key]
+
+    def thresholded(self, gblur_sigma=1, threshold="80%"):
+        """Return a Tuple (thresholded aims volume, offset)"""
+        key = (gblur_sigma, threshold)
+        if key not in self._thresholded:
+            gblur, offset = self.blurred(gblur_sigma)
+            # _threshold_volume rescales its input in place
+            thresh_vol = _threshold_volume(
+                gblur.copy(), threshold, self.low_memory)
+            self._thresholded[key] = (thresh_vol, offset)
+        return self._thresholded[key]
+
+    def raw_mesh(self, gblur_sigma=1, threshold="80%"):
+        """Return a Tuple (mesh, offset) where mesh is neither smoothed nor decimated.
+        The returned mesh is shared with the cache and must not be modified."""
+        key = (gblur_sigma, threshold)
+        if key not in self._raw_meshes:
+            thresh_vol, offset = self.thresholded(gblur_sigma, threshold)
+            mesh = _join_mesher_output(_get_mesher().doit(thresh_vol))
+            self._raw_meshes[key] = (mesh, offset)
+        return self._raw_meshes[key]
+
+    def mesh(self, gblur_sigma=1, threshold="80%",
+             deciMaxError=1.0, deciMaxClearance=3.0,
+             deciReductionRate=99, smoothRate=0.4,
+             smoothIt=30, translation=(0, 0, 0)):
+        """Return a new mesh. See volume_to_mesh() for the description of the arguments.
+
+        The smoothing (resp. the decimation) is skipped if smoothIt (resp. deciReductionRate) is None."""
+        raw_mesh, offset = self.raw_mesh(gblur_sigma, threshold)
+        mesh = _mesh.copy_mesh(raw_mesh)
+
+        m = _get_mesher(deciReductionRate, deciMaxClearance, deciMaxError,
+                        smoothRate, smoothIt)
+        if smoothIt:
+            m.smooth(mesh)
+        if deciReductionRate is not None:
+            m.decimate(mesh)
+
+        assert len(translation) == 3, "len(translation) must be 3"
+        return _translate_mesh(mesh, np.add(translation, offset))
+
+
+def _mesh_one_label(data):
+    """Mesh one label of a cropped labelled volume.
+    This function is adapted for multiprocessing: the mesh is returned as a dict."""
+    mask = (data['vol'] == data['label']).astype(np.uint8)
+    mesh = volume_to_mesh(mask, translation=data['translation'],
+                          **data['meshing_parameters'])
+    if not isinstance(mesh, _PyMesh):
+        # aims mesh (aims backend)
+        mesh = _PyMesh(mesh)
+    return {"label": data['label'], "mesh": mesh.to_dict()}
+
+
+def volume_to_meshes_by_label(vol, labels=None, n_jobs=None, translation=(0, 0, 0), **meshing_parameters):
+    """Calculate the mesh of each label of a labelled volume.
+
+    The bounding boxes of all the labels are found in one pass with
+    scipy.ndimage.find_objects, then each label is meshed in its own
+    sub-volume (enlarged for the gaussian blur), in parallel.
+
+    Args:
+        vol (nparray or aims Volume): labelled volume with positive integer labels (0 is the background).
+        labels (Sequence[int], optional): the labels to mesh. Defaults to all the labels in the volume.
+        n_jobs (int, optional): number of processes. Defaults to the number of CPUs.
+        translation (vector or 3 int) : translation to apply to all the meshes.
+
+        meshing_parameters are passed to volume_to_mesh()
+
+    Returns:
+        dict: {label:aims_mesh}, the meshes are in the coordinates system of the input volume.
+        With backend="numpy" the meshes are wrappers.PyMesh, as returned by volume_to_mesh().
+    """
+    vol = volume_to_ndarray(vol)
+    assert np.issubdtype(vol.dtype, np.integer), "The labels must be integers"
+
+    margin = _gaussian_radius(meshing_parameters.get('gblur_sigma', 1)) + 1
+    boxes = _ndimage.find_objects(vol)
+    if labels is None:
+        labels = [i+1 for i, box in enumerate(boxes) if box is not None]
+
+    data = []
+    for label in labels:
+        if label < 1 or label > len(boxes) or boxes[label-1] is None:
+            log.warning(f"Label {label} is not in the volume.")
+            continue
+        box = tuple(slice(max(s.start - margin, 0), min(s.stop + margin, n))
+                    for s, n in zip(boxes[label-1], vol.shape))
+        data.append(dict(
+            label=label,
+            vol=vol[box],
+            translation=np.add(translation, [s.start for s in box]),
+            meshing_parameters=meshing_parameters
+        ))
+
+    if n_jobs is None:
+        n_jobs = _cpu_count()
+
+    if n_jobs > 1 and len(data) > 1:
+        with _Pool(min(n_jobs, len(data))) as pool:
+            res = pool.map(_mesh_one_label, data)
+    else:
+        res = [_mesh_one_label(d) for d in data]
+
+    # aims objects can not be pickled: the meshes are rebuilt here
+    meshes = dict()
+    for r in res:
+        mesh = _PyMesh()
+        mesh.from_elements(**r['mesh'])
+        if meshing_parameters.get('backend', 'aims') == 'aims':
+            mesh = mesh.to_aims_mesh()
+        meshes[r['label']] = mesh
+    return meshes
 
 
 def bucket_to_mesh(bucket, gblur_sigma=0, threshold=1,
                    deciMaxError=1.0, deciMaxClearance=3.0,
                    deciReductionRate=0, smoothRate=0.15,
-                   smoothIt=30, translation=(0, 0, 0)):
+                   smoothIt=30, translation=(0, 0, 0), tight=False):
     """Generate the mesh of the input bucket.
     WARNING: This function directly call some BrainVisa command line tools via os.system calls.
 
     Args:
         bucket (nparray or pyaims bucket): The input bucket.
+        tight (bool, optional): if True, the bucket is rasterized in a volume
+            covering only its bounding box, padded according to gblur_sigma,
+            instead of a volume that includes the origin. This is much faster
+            for buckets far from the origin (e.g. in Talairach space).
+            Defaults to False.
 
     see volume_to_mesh for a description of the other arguments
 
@@ -380,12 +932,19 @@ def bucket_to_mesh(bucket, gblur_sigma=0, threshold=1,
     elif isinstance(bucket, _aims.BucketMap_VOID):
         raise ValueError("Input is a BucketMap, not a bucket.")
 
-    if any([x-int(x) != 0 for x in bucket[:].ravel()]):
+    bucket = np.asarray(bucket)
+    if np.any(bucket != np.round(bucket)):
         log.debug(
             "This bucket's coordinates are not integers. Did you apply any transformation to it?")
 
-    volume, offset = bucket_numpy_to_volume_numpy(bucket)
-    translation += offset
+    if tight:
+        # leave room for the gaussian blur and the mesher around the object
+        pad = _gaussian_radius(gblur_sigma) + 1
+    else:
+        pad = 0
+    volume, offset = bucket_numpy_to_volume_numpy(
+        bucket, pad=pad, dtype=np.uint8, tight=tight)
+    translation = np.add(translation, offset - pad)
 
     mesh = volume_to_mesh(volume, gblur_sigma=gblur_sigma, threshold=threshold, smoothRate=smoothRate,
                           deciMaxError=deciMaxError, deciMaxClearance=deciMaxClearance, smoothIt=smoothIt,
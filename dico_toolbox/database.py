@@ -1,11 +1,18 @@
 # [treesource] access Brainvisa databases
 import os.path as op
-from os import listdir
 import os
 from typing import Union
 from collections.abc import Sequence
-from glob import glob
 from warnings import warn
+import json
+import re
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+
+INDEX_VERSION = 1
+# suffixes of the files that are never listed (graph sidecars, see sidecar.SIDECAR_EXTENSION)
+IGNORED_SUFFIXES = (".dtb.npz",)
 
 
 def extend_templates(templates, default_value=None, start_tag="[", end_tag="]", **kwargs):
@@ -13,9 +20,9 @@ def extend_templates(templates, default_value=None, start_tag="[", end_tag="]",
     if not isinstance(templates, (list, tuple)):
         templates = [templates]
 
+    used_keys = list(kwargs.keys())
     if default_value is not None:
         # If specified, replace unused tag by the default value
-        used_keys = list(kwargs.keys())
         unused_keys = set()
         for template in templates:
             split = template.split(start_tag)
@@ -45,12 +52,102 @@ def extend_templates(templates, default_value=None, start_tag="[", end_tag="]",
     return templates
 
 
+def _glob_to_regex(pattern):
+    """ Translate the wildcards * and ? of a path pattern into a regular expression that does not match '/'. """
+    regex = []
+    for c in pattern:
+        if c == '*':
+            regex.append('[^/]*')
+        elif c == '?':
+            regex.append('[^/]')
+        else:
+            regex.append(re.escape(c))
+    return ''.join(regex)
+
+
+def _has_wildcards(pattern, start_tag="["):
+    return any(c in pattern for c in ('*', '?', start_tag))
+
+
+def compile_template(template, start_tag="[", end_tag="]", captured=None, **kwargs):
+    """ Compile a template into a regular expression with one named group per tag.
+
+        The second occurrence of a tag must have the same value as the first one
+        (e.g. the subject in "[subject]/t1mri/[hemi][subject].arg").
+        The values of a tag can be restricted by kwargs (a value or a list of values,
+        that can contain * and ? wildcards). The * and ? in the template are wildcards too.
+        captured is a dictionnary of the already known values of some tags.
+
+        Example
+        =======
+        >>> regex = compile_template("[center]/[subject]/t1mri/*/*/folds/3.3/[hemi][subject].arg", hemi=["L", "R"])
+        >>> regex.fullmatch("c1/sub-01/t1mri/acq/ana/folds/3.3/Lsub-01.arg").groupdict()
+        {'center': 'c1', 'subject': 'sub-01', 'hemi': 'L'}
+    """
+    captured = captured or {}
+    tag_regex = re.compile(re.escape(start_tag) + r"(\w+)" + re.escape(end_tag))
+    regex = []
+    seen = set()
+    position = 0
+    for match in tag_regex.finditer(template):
+        regex.append(_glob_to_regex(template[position:match.start()]))
+        tag = match.group(1)
+        if tag in captured:
+            regex.append(re.escape(captured[tag]))
+        elif tag in seen:
+            regex.append(f"(?P={tag})")
+        else:
+            seen.add(tag)
+            values = kwargs.get(tag)
+            if values is None or (isinstance(values, (list, tuple)) and len(values) == 0):
+                pattern = "[^/]+?"
+            else:
+                if not isinstance(values, (list, tuple)):
+                    values = [values]
+                pattern = "|".join(_glob_to_regex(str(v)) for v in values)
+            regex.append(f"(?P<{tag}>{pattern})")
+        position = match.end()
+    regex.append(_glob_to_regex(template[position:]))
+    return re.compile(''.join(regex))
+
+
+def iter_templates(templates, start_tag="[", end_tag="]", **kwargs):
+    """ Yield the paths given by all the combinations of the values of the tags, one at a time.
+
+        The templates that do not contain all the tags of kwargs are skipped.
+    """
+    if not isinstance(templates, (list, tuple)):
+        templates = [templates]
+    keys = list(kwargs.keys())
+    values = [v if isinstance(v, (list, tuple)) else [v] for v in kwargs.values()]
+    tags = [start_tag + k + end_tag for k in keys]
+    for template in templates:
+        if not all(tag in template for tag in tags):
+            continue
+        for combination in itertools.product(*values):
+            path = template
+            for tag, val in zip(tags, combination):
+                path = path.replace(tag, str(val))
+            yield path
+
+
 FILES_COUNT_WARNING = 500
 
 
 class FileDatabase:
     def __init__(self, path: str, directory_levels=[], templates: dict = {},
-                 allowed_extensions="*", forbidden_extensions=[]):
+                 allowed_extensions="*", forbidden_extensions=[], index_path=None):
+        """
+        Args:
+            path (str): root directory of the database
+            directory_levels (list of str): names of the attributes given by the directories levels
+            templates (dict): {name: template} of the paths of the files, relative to path
+            allowed_extensions ("*" | list of str): extensions of the listed files
+            forbidden_extensions (list of str): extensions of the ignored files
+            index_path (str, optional): path of a file where the result of the scan is saved.
+                If the file exists, it is loaded instead of scanning the database, and
+                refresh() only lists again the directories that have been modified.
+        """
         if not op.isdir(path):
             raise IOError(
                 "The database path must point to an existing directory.")
@@ -61,12 +158,17 @@ class FileDatabase:
         self.templates = templates
         self.directory_levels = directory_levels
 
-        self.files = []
-        self.files_attributes = []
-        self.attributes = []
+        self._clear_files()
 
-    def is_valid_path(self, path: str):
-        if not op.isfile(path):
+        # {directory path: (modification time, sub-directories, files)}
+        self._listings = {}
+        self._previous_listings = {}
+        self.index_path = index_path
+        if index_path is not None and op.exists(index_path):
+            self.load_index()
+
+    def _is_valid_extension(self, path: str):
+        if path.endswith(IGNORED_SUFFIXES):
             return False
         ext = op.splitext(path)[1][1:]
 
@@ -75,7 +177,9 @@ class FileDatabase:
 
         return ext in self.allowed_extensions and ext not in self.forbidden_extensions
 
-    # TODO: add possibility to specify integer values in templates (+ formating)
+    def is_valid_path(self, path: str):
+        return op.isfile(path) and self._is_valid_extension(path)
+
     def get_from_template(self, template, **kwargs):
         """ Search files by parsing a template
 
@@ -84,54 +188,104 @@ class FileDatabase:
             >>>> graph = db.get_from_template("*/[subject]/t1mr1/*/*/folds/3.3/[session]/[hemi][session]_[subject].arg",
                                                 subject=["sub-01", "sub-05"], session="session_manual", hemi="L")
         """
-        if template in self.templates:
-            template = self.templates[template]
+        return [path for path, _ in self.find_from_template(template, **kwargs)]
 
-        paths = extend_templates(
-            op.join(self.path, template), default_value="*", **kwargs)
+    def find_from_template(self, template, use_index=False, start_tag="[", end_tag="]", **kwargs):
+        """ Search files by parsing a template and return their paths with the values of the tags.
 
-        file_paths = []
-        for p in paths:
-            file_paths.extend(glob(p))
+            The template is compiled into a regular expression (see compile_template()).
+            By default, the directories are walked once, only listing those that can match
+            the beginning of the template. If use_index is True, the template is matched
+            against the files found by the last scan of the database, without accessing the disk.
 
-        results = []
-        for fpath in file_paths:
-            if self.is_valid_path(fpath):
-                results.append(fpath)
-        return results
+            Example
+            ========
+            >>>> for path, attributes in db.find_from_template("morphologist_labelled_graph", subject=["001", "002"],
+                                                               session="session1_manual", hemi=["L", "R"]):
+            ....     print(attributes["subject"], attributes["hemi"], path)
+        """
+        if template in self.templates:
+            template = self.templates[template]
+        template = op.join(self.path, template)
+
+        if use_index:
+            if len(self.files) == 0:
+                self.scan()
+            regex = compile_template(template, start_tag, end_tag, **kwargs)
+            results = []
+            for path in self.files:
+                match = regex.fullmatch(path)
+                if match:
+                    results.append((path, match.groupdict()))
+            return results
+
+        # start from the deepest directory without wildcards
+        parts = template.split('/')
+        n = 0
+        while n < len(parts) - 1 and not _has_wildcards(parts[n], start_tag):
+            n += 1
+        root = '/'.join(parts[:n]) or '/'
+        if not op.isdir(root):
+            return []
+        return list(self._walk_template(root, parts[n:], {}, start_tag, end_tag, kwargs))
+
+    def _walk_template(self, directory, parts, captured, start_tag, end_tag, kwargs):
+        part = parts[0]
+        last = len(parts) == 1
+        if not _has_wildcards(part, start_tag):
+            # no need to list the directory
+            path = op.join(directory, part)
+            if last:
+                if self.is_valid_path(path):
+                    yield path, captured
+            elif op.isdir(path):
+                yield from self._walk_template(path, parts[1:], captured, start_tag, end_tag, kwargs)
+            return
 
-    def generate_from_templates(self, templates, start_tag="[", end_tag="]", makedirs=False, **kwargs):
-        """ Usefull to generate new files paths """
+        regex = compile_template(part, start_tag, end_tag, captured, **kwargs)
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for entry in entries:
+            match = regex.fullmatch(entry.name)
+            if match is None:
+                continue
+            entry_captured = dict(captured, **match.groupdict())
+            if last:
+                if entry.is_file() and self._is_valid_extension(entry.path):
+                    yield entry.path, entry_captured
+            elif entry.is_dir():
+                yield from self._walk_template(entry.path, parts[1:], entry_captured, start_tag, end_tag, kwargs)
+
+    def generate_from_templates(self, templates, start_tag="[", end_tag="]", makedirs=False, lazy=False, **kwargs):
+        """ Usefull to generate new files paths
+
+            If lazy is True, a generator is returned: the paths are generated
+            (and their directories created) one at a time.
+        """
         if not isinstance(templates, (tuple, list)):
             templates = [templates]
 
-        for t in range(len(templates)):
-            if templates[t] in self.templates:
-                templates[t] = op.join(self.path, self.templates[templates[t]])
-
-        for k in kwargs.keys():
-            tag = start_tag + k + end_tag
-            if not isinstance(kwargs[k], (list, tuple)):
-                kwargs[k] = [kwargs[k]]
-            new_templates = []
-            for template in templates:
-                if tag in template:
-                    for val in kwargs[k]:
-                        new_templates.append(template.replace(
-                            start_tag + k + end_tag, val))
-            templates = new_templates
+        templates = [op.join(self.path, self.templates[t]) if t in self.templates else t
+                     for t in templates]
 
+        paths = iter_templates(templates, start_tag, end_tag, **kwargs)
         if makedirs:
-            for templ in templates:
-                d, _ = op.split(templ)
-                os.makedirs(d, exist_ok=True)
-        return templates
+            paths = self._makedirs_of(paths)
+        return paths if lazy else list(paths)
+
+    @staticmethod
+    def _makedirs_of(paths):
+        for path in paths:
+            d, _ = op.split(path)
+            os.makedirs(d, exist_ok=True)
+            yield path
 
     def generate_from_template(self, template, start_tag="[", end_tag="]", makedirs=False, **kwargs):
         return self.generate_from_templates(template, start_tag, end_tag, makedirs, **kwargs)[0]
 
     def _add_file(self, path, **kwargs):
-        if not self.is_valid_path(path) or path in self.files:
+        # the scanners only give paths of existing files: no need to stat them again
+        if not self._is_valid_extension(path) or path in self._file_ids:
             return
 
         if len(self.files) == FILES_COUNT_WARNING:
@@ -146,37 +300,78 @@ class FileDatabase:
         kwargs = {k: v for k, v in kwargs.items() if v is not None}
 
         # TODO: use .minf to get more attributes?
+        kwargs['type'] = infer_file_type(path, kwargs)
+        self._register_file(path, kwargs)
+
+    def _clear_files(self):
+        # The position of a file in self.files is its id.
+        self.files = []
+        self.files_attributes = []
+        self.attributes = {}
+        self._file_ids = {}
+        # inverted index {attribute: {value: set of file ids}}
+        self._inverted_index = {}
+
+    def _register_file(self, path, kwargs):
+        file_id = len(self.files)
         self.files.append(path,)
         self.files_attributes.append(kwargs)
-        self.files_attributes[-1]['type'] = infer_file_type(path, kwargs)
-        for k in kwargs:
-            if k not in self.attributes.keys():
-                self.attributes[k] = [kwargs[k]]
-            elif kwargs[k] not in self.attributes[k]:
-                self.attributes[k].append(kwargs[k])
-
-    def _scan_subdirectories(self, path, levels, **kwargs):
+        self._file_ids[path] = file_id
+        for k, v in kwargs.items():
+            values = self._inverted_index.setdefault(k, {})
+            if v not in values:
+                values[v] = set()
+                self.attributes.setdefault(k, []).append(v)
+            values[v].add(file_id)
+
+    def _list_directory(self, path, listings=None):
+        """Return the lists of the names of the sub-directories and of the files of a directory.
+
+        During an incremental scan, the listing of the previous scan is reused
+        if the modification time of the directory did not change.
+        The listing is stored in listings (default: self._listings), so that
+        the scanning threads do not modify the database.
+        """
+        if listings is None:
+            listings = self._listings
+        listing = listings.get(path, self._listings.get(path))
+        if listing is not None:
+            # already listed during this scan
+            return listing[1], listing[2]
+        mtime = os.stat(path).st_mtime_ns
+        listing = self._previous_listings.get(path)
+        if listing is None or listing[0] != mtime:
+            dirs, files = [], []
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        dirs.append(entry.name)
+                    elif entry.is_file():
+                        files.append(entry.name)
+            listing = (mtime, dirs, files)
+        listings[path] = listing
+        return listing[1], listing[2]
+
+    def _scan_subdirectories(self, path, levels, add=None, listings=None, **kwargs):
+        if add is None:
+            add = self._add_file
         not_scanned_paths = []
         sub_kwargs = kwargs.copy()
-        for item in listdir(path):
-            item_path = op.join(path, item)
-            if op.isdir(item_path):
-                if item[0] is not '.':
-                    sub_kwargs[levels[0]] = item
-                    if len(levels) > 1:
-                        self._scan_subdirectories(
-                            item_path, levels[1:], **sub_kwargs)
-                    else:
-                        not_scanned_paths.append(item_path)
-            else:
-                self._add_file(item_path, **kwargs)
+        dirs, files = self._list_directory(path, listings)
+        for item in dirs:
+            if not item.startswith('.'):
+                item_path = op.join(path, item)
+                sub_kwargs[levels[0]] = item
+                if len(levels) > 1:
+                    not_scanned_paths += self._scan_subdirectories(
+                        item_path, levels[1:], add, listings, **sub_kwargs)
+                else:
+                    not_scanned_paths.append(item_path)
+        for item in files:
+            add(op.join(path, item), **kwargs)
         return not_scanned_paths
 
-    def scan(self):
-        self.files = []
-        self.files_attributes = []
-        self.attributes = {}
-
+    def _scan(self):
         # Expect output as:
         # db/center/subject/acqusition/analysis/segmentation
         # db/center/subject/acqusition/analysis/folds
@@ -185,6 +380,55 @@ class FileDatabase:
         self.unscan_paths = self._scan_subdirectories(
             self.path, self.directory_levels)
 
+    def scan(self, incremental=False):
+        """ List all the files of the database.
+
+            If incremental is True, the directories that have not been modified since
+            the last scan are not listed again.
+            The result is saved in the index file if the database has one.
+        """
+        self._clear_files()
+        self._previous_listings = self._listings if incremental else {}
+        self._listings = {}
+        try:
+            self._scan()
+        finally:
+            self._previous_listings = {}
+
+        if self.index_path is not None:
+            self.save_index()
+
+    def refresh(self):
+        """ Update the list of files, only listing again the directories modified since the last scan. """
+        self.scan(incremental=True)
+
+    def save_index(self, path=None):
+        """ Save the scanned files, their attributes and the directory listings in a json file. """
+        path = self.index_path if path is None else path
+        index = dict(version=INDEX_VERSION, root=op.realpath(self.path),
+                     files=self.files, files_attributes=self.files_attributes,
+                     listings=self._listings)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, path)
+
+    def load_index(self, path=None):
+        """ Load an index saved by save_index(). Return False if it belongs to another database. """
+        path = self.index_path if path is None else path
+        with open(path) as f:
+            index = json.load(f)
+        if index.get('version') != INDEX_VERSION or index.get('root') != op.realpath(self.path):
+            warn(f"{path} is not an index of {self.path}, it is ignored.")
+            return False
+
+        self._clear_files()
+        self._listings = {d: tuple(listing)
+                          for d, listing in index['listings'].items()}
+        for fpath, attributes in zip(index['files'], index['files_attributes']):
+            self._register_file(fpath, attributes)
+        return True
+
     def list_all(self, attribute_name: str, **kwargs):
         """ List all attribute_name attribute for files that match kwargs specificiation.
 
@@ -204,56 +448,65 @@ class FileDatabase:
         if len(self.files) == 0:
             self.scan()
 
-        for k in kwargs.keys():
-            if not isinstance(kwargs[k], (list, tuple)):
-                kwargs[k] = [kwargs[k]]
-
-        results = set()
-        for attributes in self.files_attributes:
-            if attribute_name in attributes.keys():
-                add = True
-                # If one of the required attribute is not ok, do not add
-                for k in kwargs.keys():
-                    if k not in attributes.keys() or (len(kwargs[k]) > 0 and attributes[k] not in kwargs[k]):
-                        add = False
-                        break
-                if add:
-                    results.add(attributes[attribute_name])
-        return list(results)
+        if len(kwargs) == 0:
+            return list(self._inverted_index.get(attribute_name, {}))
+
+        values = set()
+        for file_id in self._query(**kwargs):
+            attributes = self.files_attributes[file_id]
+            if attribute_name in attributes:
+                values.add(attributes[attribute_name])
+        return list(values)
+
+    def _query(self, **kwargs):
+        """ Return the set of the ids of the files that match the query (see BVDatabase). """
+        sets = []
+        for k, needed in kwargs.items():
+            index = self._inverted_index.get(k, {})
+            if not isinstance(needed, (list, tuple, set)):
+                needed = [needed]
+            if len(needed) == 0:
+                # any value
+                needed = index.keys()
+            ids = [index[v] for v in needed if v in index]
+            if len(ids) == 1:
+                sets.append(ids[0])
+            else:
+                sets.append(set().union(*ids))
+        if len(sets) == 0:
+            return set(range(len(self.files)))
+        # start with the most selective attribute to keep the intersections small
+        sets.sort(key=len)
+        selected = set(sets[0])
+        for ids in sets[1:]:
+            if len(selected) == 0:
+                break
+            selected &= ids
+        return selected
 
     def get(self, **kwargs):
         """ Use the same query system that for list_all but list all matching files paths. """
         if len(self.files) == 0:
             self.scan()
 
-        for k in kwargs.keys():
-            if not isinstance(kwargs[k], (list, tuple)):
-                kwargs[k] = [kwargs[k]]
-
-        results = []
-        for path, attributes in zip(self.files, self.files_attributes):
-            for k in kwargs.keys():
-                add = True
-                for k in kwargs.keys():
-                    if k not in attributes.keys() or (len(kwargs[k]) > 0 and attributes[k] not in kwargs[k]):
-                        add = False
-                        break
-                if add:
-                    results.append(path)
-                    break
-        return results
+        return [self.files[i] for i in sorted(self._query(**kwargs))]
 
     def get_attribute_of(self, path: str) -> dict():
-        # TODO: implement this
-        raise NotImplementedError()
+        """ Return the attributes of a file of the database. """
+        if len(self.files) == 0:
+            self.scan()
+        try:
+            return self.files_attributes[self._file_ids[path]]
+        except KeyError:
+            raise ValueError(f"{path} is not a file of the database") from None
 
 
 def infer_file_type(fpath, attributes):
     """ Infer Axon file type from the path and attributes """
     # TODO: list file type somewhere
-    if attributes['extension'] == '.arg':
+    if attributes['extension'] == 'arg':
         return "graph"
-    elif attributes['extension'] == '.his':
+    elif attributes['extension'] == 'his':
         return "histogram"
     return "unkown"
 
@@ -289,13 +542,21 @@ class BVDatabase(FileDatabase):
         '''
     """
 
-    def __init__(self, path: str):
+    def __init__(self, path: str, index_path=None, n_jobs=8):
+        """
+        Args:
+            path (str): root directory of the database
+            index_path (str, optional): path of the scan index file (see FileDatabase).
+            n_jobs (int, optional): number of threads listing the subjects directories during a scan.
+        """
+        self.n_jobs = n_jobs
         super().__init__(
             path,
             templates=BV_TEMPLATES,
             directory_levels=["center", "subject",
                               "modality", "acquisition", "analysis"],
-            forbidden_extensions=['minf']
+            forbidden_extensions=['minf'],
+            index_path=index_path
         )
 
     def _add_file(self, path, **kwargs):
@@ -303,111 +564,139 @@ class BVDatabase(FileDatabase):
         # TODO: use .minf to get more attributes?
         # self.files_attributes[-1]['type'] = infer_file_type(path, kwargs)
 
-    def _scan_morphologist_analyses(self, modality="t1mri"):
-        # Look for Morphologist outputs
-        for center in self.list_all('center'):
-            for sub in self.list_all('subject', center=center, modality=modality):
-                for acq in self.list_all('acquisition', center=center, subject=sub, modality=modality):
-                    for ana in listdir(op.join(self.path, center, sub, modality, acq)):
-                        # for ana in self.list_all('subject', center=center, subject=sub, modality="t1mri", acquisition=acq):
-                        ana_path = op.join(
-                            self.path, center, sub, modality, acq, ana)
-                        if not op.isdir(ana_path):
-                            continue
-                        seg_path = op.join(ana_path, "segmentation")
-                        mesh_path = op.join(seg_path, "mesh")
-                        fold_path = op.join(ana_path, "folds")
-
-                        for f in listdir(ana_path):
-                            fpath = op.join(ana_path, f)
-                            if op.isfile(fpath):
-                                self._add_file(
-                                    fpath, center=center, subject=sub, modality=modality,
-                                    acquisition=acq, analysis=ana)
-
-                        # Segmented volumes
-                        if op.isdir(seg_path):
-                            for f in listdir(seg_path):
-                                fpath = op.join(seg_path, f)
-                                if op.isfile(fpath):
-                                    # [hemi][seg_type]_[subject].[extension]
-                                    fname, _ = op.splitext(f)
-                                    seg_type = fname[:-len(sub)-1] if len(
-                                        fname) > len(sub) else None
-                                    hemi = f[0]
-
-                                    if hemi in ['L', 'R']:
-                                        # cortex, grey_white,, gw_interface, roots, skeleton
-                                        hemi = 'left' if hemi == 'L' else 'right'
-                                        self._add_file(fpath, center=center, subject=sub, modality=modality,
-                                                       acquisition=acq, analysis=ana, segmentation=seg_type,
-                                                       hemisphere=hemi)
-                                    else:
-                                        # brain, head, skull_stripped, voronoi
-                                        self._add_file(fpath, center=center, subject=sub, modality=modality,
-                                                       acquisition=acq, analysis=ana, segmentation=seg_type)
-                            # Meshes
-                            if op.isdir(mesh_path):
-                                for f in listdir(mesh_path):
-                                    fpath = op.join(mesh_path, f)
-                                    if op.isfile(fpath):
-                                        # [subject]_[hemi][seg_type].[extension]
-                                        fname, _ = op.splitext(f)
-                                        mesh_type = fname[len(
-                                            sub)+1:] if len(fname) > len(sub) else None
-                                        hemi = mesh_type[0] if mesh_type else None
-
-                                        if hemi in ['L', 'R']:
-                                            # white, hemi
-                                            mesh_type = mesh_type[1:]
-                                            hemi = 'left' if hemi == 'L' else 'right'
-                                            self._add_file(fpath, center=center, subject=sub, modality=modality,
-                                                           acquisition=acq, analysis=ana, mesh=mesh_type,
-                                                           hemisphere=hemi)
-                                        else:
-                                            # head
-                                            self._add_file(fpath, center=center, subject=sub, modality=modality,
-                                                           acquisition=acq, analysis=ana, mesh=mesh_type)
-                        # Graphs
-                        if op.isdir(fold_path):
-                            for version in listdir(fold_path):
-                                fold_subpath = op.join(fold_path, version)
-
-                                for f in listdir(fold_subpath):
-                                    fpath = op.join(fold_subpath, f)
-                                    if op.isfile(fpath):
-                                        # [hemi][subject]_[seg_type].[extension]
-                                        fname, _ = op.splitext(f)
-                                        seg_type = fname[len(
-                                            sub)+1:] if len(fname) > len(sub) else None
-                                        hemi = fname[0]
-                                        if hemi in ['L', 'R']:
-                                            # sulcivoronoi (also a segmentation file)
-                                            seg_type = seg_type[1:]
-                                            hemi = 'left' if hemi == 'L' else 'right'
-                                            self._add_file(fpath, center=center, subject=sub, modality=modality,
-                                                           acquisition=acq, analysis=ana, segmentation=seg_type,
-                                                           hemisphere=hemi)
-                                        else:
-                                            # ?
-                                            self._add_file(fpath, center=center, subject=sub, modality=modality,
-                                                           acquisition=acq, analysis=ana, mesh=mesh_type)
-                                    else:
-                                        session = f
-                                        session_path = op.join(
-                                            fold_subpath, session)
-                                        for f in listdir(session_path):
-                                            fpath = op.join(session_path, f)
-                                            if op.isfile(fpath) and f[-4:] == ".arg":
-                                                # [hemi][subject]_[session].arg
-                                                fname, _ = op.splitext(f)
-                                                hemi = fname[0]
-                                                if hemi in ['L', 'R']:
-                                                    hemi = 'left' if hemi == 'L' else 'right'
-                                                    self._add_file(fpath, center=center, subject=sub, modality=modality,
-                                                                   acquisition=acq, analysis=ana, hemisphere=hemi,
-                                                                   graph_version=version, graph_session=session)
-
-    def scan(self):
-        super().scan()
-        self._scan_morphologist_analyses()
+    def _scan_subject(self, subject_path, center, sub, modality="t1mri"):
+        """ List the files of one subject directory, including the outputs of Morphologist.
+
+            Returns the list of the (path, attributes) of the files, the paths of the
+            analysis directories and the directory listings. The database is not modified,
+            so that several subjects can be scanned in parallel.
+        """
+        found = []
+        listings = {}
+
+        def add(path, **kwargs):
+            found.append((path, kwargs))
+
+        ana_paths = self._scan_subdirectories(
+            subject_path, self.directory_levels[2:], add, listings,
+            center=center, subject=sub)
+        for ana_path in ana_paths:
+            mod, acq, ana = op.relpath(ana_path, subject_path).split(op.sep)
+            if mod == modality:
+                self._scan_morphologist_analysis(
+                    add, listings, ana_path, center, sub, modality, acq, ana)
+        return found, ana_paths, listings
+
+    def _scan_morphologist_analysis(self, add, listings, ana_path, center, sub, modality, acq, ana):
+        """ List the outputs of Morphologist in one analysis directory and pass them to add(path, **attributes). """
+        seg_path = op.join(ana_path, "segmentation")
+        mesh_path = op.join(seg_path, "mesh")
+        fold_path = op.join(ana_path, "folds")
+
+        ana_dirs, ana_files = self._list_directory(ana_path, listings)
+        for f in ana_files:
+            fpath = op.join(ana_path, f)
+            add(
+                fpath, center=center, subject=sub, modality=modality,
+                acquisition=acq, analysis=ana)
+
+        # Segmented volumes
+        if "segmentation" in ana_dirs:
+            seg_dirs, seg_files = self._list_directory(seg_path, listings)
+            for f in seg_files:
+                fpath = op.join(seg_path, f)
+                # [hemi][seg_type]_[subject].[extension]
+                fname, _ = op.splitext(f)
+                seg_type = fname[:-len(sub)-1] if len(
+                    fname) > len(sub) else None
+                hemi = f[0]
+
+                if hemi in ['L', 'R']:
+                    # cortex, grey_white,, gw_interface, roots, skeleton
+                    hemi = 'left' if hemi == 'L' else 'right'
+                    add(fpath, center=center, subject=sub, modality=modality,
+                        acquisition=acq, analysis=ana, segmentation=seg_type,
+                        hemisphere=hemi)
+                else:
+                    # brain, head, skull_stripped, voronoi
+                    add(fpath, center=center, subject=sub, modality=modality,
+                        acquisition=acq, analysis=ana, segmentation=seg_type)
+            # Meshes
+            if "mesh" in seg_dirs:
+                for f in self._list_directory(mesh_path, listings)[1]:
+                    fpath = op.join(mesh_path, f)
+                    # [subject]_[hemi][seg_type].[extension]
+                    fname, _ = op.splitext(f)
+                    mesh_type = fname[len(
+                        sub)+1:] if len(fname) > len(sub) else None
+                    hemi = mesh_type[0] if mesh_type else None
+
+                    if hemi in ['L', 'R']:
+                        # white, hemi
+                        mesh_type = mesh_type[1:]
+                        hemi = 'left' if hemi == 'L' else 'right'
+                        add(fpath, center=center, subject=sub, modality=modality,
+                            acquisition=acq, analysis=ana, mesh=mesh_type,
+                            hemisphere=hemi)
+                    else:
+                        # head
+                        add(fpath, center=center, subject=sub, modality=modality,
+                            acquisition=acq, analysis=ana, mesh=mesh_type)
+        # Graphs
+        if "folds" in ana_dirs:
+            for version in self._list_directory(fold_path, listings)[0]:
+                fold_subpath = op.join(fold_path, version)
+                sessions, version_files = self._list_directory(fold_subpath, listings)
+
+                for f in version_files:
+                    fpath = op.join(fold_subpath, f)
+                    # [hemi][subject]_[seg_type].[extension]
+                    fname, _ = op.splitext(f)
+                    seg_type = fname[len(
+                        sub)+1:] if len(fname) > len(sub) else None
+                    hemi = fname[0]
+                    if hemi in ['L', 'R']:
+                        # graph ([hemi][subject].arg) or sulcivoronoi (also a segmentation file)
+                        seg_type = seg_type[1:] if seg_type else seg_type
+                        hemi = 'left' if hemi == 'L' else 'right'
+                        add(fpath, center=center, subject=sub, modality=modality,
+                            acquisition=acq, analysis=ana, segmentation=seg_type,
+                            hemisphere=hemi)
+                    else:
+                        # ?
+                        add(fpath, center=center, subject=sub, modality=modality,
+                            acquisition=acq, analysis=ana, segmentation=seg_type)
+                for session in sessions:
+                    session_path = op.join(
+                        fold_subpath, session)
+                    for f in self._list_directory(session_path, listings)[1]:
+                        fpath = op.join(session_path, f)
+                        if f[-4:] == ".arg":
+                            # [hemi][subject]_[session].arg
+                            fname, _ = op.splitext(f)
+                            hemi = fname[0]
+                            if hemi in ['L', 'R']:
+                                hemi = 'left' if hemi == 'L' else 'right'
+                                add(fpath, center=center, subject=sub, modality=modality,
+                                    acquisition=acq, analysis=ana, hemisphere=hemi,
+                                    graph_version=version, graph_session=session)
+
+    def _scan(self):
+        # The centers and the subjects are listed by this thread, then the subjects
+        # are scanned in parallel by n_jobs threads, which lets the latency of network
+        # file systems overlap. Only this thread modifies the database.
+        subject_paths = self._scan_subdirectories(self.path, self.directory_levels[:2])
+        subjects = [(path, *op.relpath(path, self.path).split(op.sep))
+                    for path in subject_paths]
+        if self.n_jobs > 1 and len(subjects) > 1:
+            with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+                results = list(executor.map(lambda s: self._scan_subject(*s), subjects))
+        else:
+            results = [self._scan_subject(*s) for s in subjects]
+
+        self.unscan_paths = []
+        for found, ana_paths, listings in results:
+            for path, kwargs in found:
+                self._add_file(path, **kwargs)
+            self.unscan_paths += ana_paths
+            self._listings.update(listings)
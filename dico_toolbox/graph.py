@@ -2,7 +2,13 @@
 from logging import warning
 import os.path as _op
 from . import convert as _convert
+from . import bucket as _bucket
+from . import transform as _transform
 import numpy as _np
+import weakref as _weakref
+import os as _os
+from collections import OrderedDict as _OrderedDict
+from scipy import sparse as _sparse
 from soma import aims as _aims
 from ._dev import _deprecation_alert_decorator
 
@@ -15,20 +21,312 @@ SPACES_TRANSFORMERS = {
 }
 
 
+# {graph: {space: 4x4 matrix}}
+_SPACE_MATRICES_CACHE = _weakref.WeakKeyDictionary()
+
+
+def get_space_matrix(graph, transform):
+    """Return the 4x4 affine matrix of a transformation of SPACES_TRANSFORMERS, or None.
+
+    The matrices are cached for each graph object, so that they are computed
+    only once per graph and per space.
+    """
+    if transform is None:
+        return None
+    try:
+        graph_matrices = _SPACE_MATRICES_CACHE.setdefault(graph, {})
+    except TypeError:
+        # the graph can not be weakly referenced: do not cache
+        graph_matrices = {}
+    if transform not in graph_matrices:
+        tr_aims = SPACES_TRANSFORMERS[transform](graph)
+        graph_matrices[transform] = None if tr_aims is None else _np.asarray(
+            tr_aims.toMatrix())
+    return graph_matrices[transform]
+
+
+class GraphCache:
+    """Size-bounded LRU cache of the graphs read from files.
+
+    The graphs are keyed on the real path, the modification time and the size
+    of the .arg file, so that a modified file is read again.
+    The cache is disabled when maxsize is 0.
+
+    NOTE: the cached graphs are shared: modifying a graph returned by the cache
+    modifies the graph returned to the next callers.
+    """
+
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        self._graphs = _OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(path):
+        path = _op.realpath(path)
+        stat = _os.stat(path)
+        return path, stat.st_mtime_ns, stat.st_size
+
+    def read(self, path):
+        """Return the graph read from path, from the cache if possible."""
+        if self.maxsize <= 0:
+            return _aims.read(path)
+
+        key = self._key(path)
+        if key in self._graphs:
+            self.hits += 1
+            self._graphs.move_to_end(key)
+            return self._graphs[key]
+
+        self.misses += 1
+        # remove the outdated versions of the file
+        self.invalidate(path)
+        graph = _aims.read(path)
+        self._graphs[key] = graph
+        while len(self._graphs) > self.maxsize:
+            self._graphs.popitem(last=False)
+        return graph
+
+    def invalidate(self, path=None):
+        """Remove the graph read from path from the cache, or all the graphs if path is None."""
+        if path is None:
+            self._graphs.clear()
+        else:
+            path = _op.realpath(path)
+            for key in [k for k in self._graphs if k[0] == path]:
+                del self._graphs[key]
+
+    def info(self):
+        """Return a dictionnary with the hits and misses counts and the size of the cache."""
+        return dict(hits=self.hits, misses=self.misses,
+                    size=len(self._graphs), maxsize=self.maxsize)
+
+    def __repr__(self):
+        return "GraphCache(hits={hits}, misses={misses}, size={size}, maxsize={maxsize})".format(**self.info())
+
+
+# Cache used by the functions of this module when a graph is given as a path.
+# Disabled by default, see enable_graph_cache()
+GRAPH_CACHE = GraphCache(maxsize=0)
+
+
+def enable_graph_cache(maxsize=8):
+    """Keep the last maxsize graphs read from a path by the functions of this module in memory.
+    Use maxsize=0 to disable the cache."""
+    GRAPH_CACHE.maxsize = maxsize
+    if maxsize <= 0:
+        GRAPH_CACHE.invalidate()
+    else:
+        while len(GRAPH_CACHE._graphs) > maxsize:
+            GRAPH_CACHE._graphs.popitem(last=False)
+
+
 def _check_graph(graph):
-    """ Check that graph is actually a graph and load it if it is a path. """
+    """ Check that graph is actually a graph and load it if it is a path.
+    If graph is a GraphIndex, the indexed graph is returned. """
+    if isinstance(graph, GraphIndex):
+        graph = graph.graph
     if isinstance(graph, str):
-        graph = _aims.read(graph)
+        graph = GRAPH_CACHE.read(graph)
     if not isinstance(graph, _aims.Graph):
         raise ValueError(
             "soma.aims.Graph was expected. {} given.".format(type(graph)))
     return graph
 
 
+class GraphIndex:
+    """Index of the vertices of a graph by the values of their attributes.
+
+    The vertices are listed once. The first query on an attribute reads its value
+    in all the vertices, then the queries on the same attribute are dictionnary
+    lookups. A GraphIndex can be passed to the functions of this module
+    in place of the graph.
+
+    NOTE: the index is not updated if the graph is modified. Build a new one.
+
+    Example
+    =======
+    '''python
+        index = GraphIndex(graph)
+        vertices = get_vertices_by_key(index, 'name', ['S.C._left', 'F.C.M._left'])
+        sizes = index.column('size')
+    '''
+    """
+
+    def __init__(self, graph, keys=()):
+        """
+        Args:
+            graph (soma.aims.Graph | str): the graph or its path
+            keys (Sequence[str], optional): attributes to index immediately. Other
+                attributes are indexed at their first query.
+        """
+        self.graph = _check_graph(graph)
+        self.vertices = self.graph.vertices().list()
+        self._values = {}
+        self._lookup = {}
+        self._columns = {}
+        for key in keys:
+            self._index(key)
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def __repr__(self):
+        return f"GraphIndex of {len(self)} vertices (indexed: {', '.join(self._values)})"
+
+    def _index(self, key):
+        if key not in self._values:
+            values = [v.get(key) for v in self.vertices]
+            lookup = {}
+            for i, val in enumerate(values):
+                try:
+                    lookup.setdefault(val, []).append(i)
+                except TypeError:
+                    # unhashable values (e.g. lists) can not be looked up
+                    pass
+            self._values[key] = values
+            self._lookup[key] = lookup
+
+    def values(self, key):
+        """Return the list of the values of key for all the vertices (None if undefined)."""
+        self._index(key)
+        return self._values[key]
+
+    def column(self, key, default=_np.nan):
+        """Return the values of key as a numpy array. Undefined values are replaced by default."""
+        if (key, default) not in self._columns:
+            values = self.values(key)
+            if any(val is None for val in values):
+                values = [default if val is None else val for val in values]
+            self._columns[(key, default)] = _np.array(values)
+        return self._columns[(key, default)]
+
+    def positions(self, key, needed_values):
+        """Return the positions in self.vertices of the vertices whose key value is in needed_values."""
+        if not isinstance(needed_values, (list, tuple, set)):
+            needed_values = [needed_values]
+        self._index(key)
+        lookup = self._lookup[key]
+        return sorted(i for val in set(needed_values) for i in lookup.get(val, []))
+
+    def get_vertices(self, key, needed_values):
+        """Return the vertices whose key value is in needed_values."""
+        return [self.vertices[i] for i in self.positions(key, needed_values)]
+
+
+def _as_index(graph):
+    return graph if isinstance(graph, GraphIndex) else GraphIndex(graph)
+
+
+def edge_table(graph, keys=None):
+    """Return the edges of a graph as a table of numpy columns.
+
+    The vertices are numbered by their position in GraphIndex.vertices: pass a
+    GraphIndex to relate the edges to the vertex columns of the index.
+
+    Args:
+        graph (soma.aims.Graph | str | GraphIndex): the graph
+        keys (list of str, optional): numeric attributes of the edges to add to the table.
+            Defaults to all the attributes with scalar numeric values. Missing values are NaN.
+
+    Returns:
+        dict: {'source': int array, 'target': int array, 'syntax': str array (e.g. 'junction'),
+        key: float array, ...}
+
+    Example
+    =======
+    '''python
+        index = GraphIndex(graph)
+        edges = edge_table(index, ['length'])
+        names = index.column('name')
+        names[edges['target'][names[edges['source']] == 'S.C._left']]
+    '''
+    """
+    index = _as_index(graph)
+    # sip returns the existing python wrapper of a C++ object, and the index
+    # keeps a reference to the wrappers of all the vertices: the vertices of
+    # the edges can then be found by identity.
+    positions = {id(v): i for i, v in enumerate(index.vertices)}
+    edges = index.graph.edges().list()
+    source = _np.empty(len(edges), dtype=_np.int64)
+    target = _np.empty(len(edges), dtype=_np.int64)
+    syntax = []
+    values = {}
+    for i, edge in enumerate(edges):
+        v1, v2 = list(edge.vertices())
+        source[i] = positions[id(v1)]
+        target[i] = positions[id(v2)]
+        syntax.append(edge.getSyntax())
+        for key in (edge.keys() if keys is None else keys):
+            val = edge.get(key)
+            if isinstance(val, (int, float, _np.number)) and not isinstance(val, bool):
+                values.setdefault(key, {})[i] = val
+
+    table = dict(source=source, target=target,
+                 syntax=_np.array(syntax, dtype=str).reshape(-1))
+    for key in (sorted(values) if keys is None else keys):
+        column = _np.full(len(edges), _np.nan)
+        key_values = values.get(key, {})
+        column[list(key_values)] = list(key_values.values())
+        table[key] = column
+    return table
+
+
+def adjacency_matrix(graph, syntax=None, weight=None, edges=None):
+    """Return the adjacency matrix of a graph as a scipy.sparse CSR matrix.
+
+    The rows and columns are the positions of the vertices in GraphIndex.vertices
+    (pass a GraphIndex to relate them to the vertex columns of the index).
+    The matrix is symmetric.
+
+    Args:
+        graph (soma.aims.Graph | str | GraphIndex): the graph
+        syntax (str | list of str, optional): keep only the edges of these types (e.g. 'junction').
+        weight (str, optional): numeric edge attribute used as matrix values (missing values are 0).
+            By default the values are the numbers of edges between the vertices.
+        edges (dict, optional): the edge_table() of the graph, if it is already computed.
+
+    Example
+    =======
+    '''python
+        index = GraphIndex(graph)
+        adjacency = adjacency_matrix(index, syntax='junction')
+        i = index.positions('name', 'S.C._left')[0]
+        neighbours = index.column('name')[adjacency[i].indices]
+        degrees = _np.diff(adjacency.indptr)
+    '''
+    """
+    index = _as_index(graph)
+    if edges is None:
+        edges = edge_table(index, [] if weight is None else [weight])
+    selection = _np.ones(len(edges['source']), dtype=bool)
+    if syntax is not None:
+        if isinstance(syntax, str):
+            syntax = [syntax]
+        selection = _np.isin(edges['syntax'], syntax)
+    source = edges['source'][selection]
+    target = edges['target'][selection]
+    if weight is None:
+        data = _np.ones(len(source))
+    else:
+        data = _np.nan_to_num(edges[weight][selection])
+    n = len(index)
+    matrix = _sparse.coo_matrix(
+        (_np.concatenate([data, data]),
+         (_np.concatenate([source, target]), _np.concatenate([target, source]))),
+        shape=(n, n))
+    return matrix.tocsr()
+
+
 def get_vertices_by_key(graph, key, needed_values):
-    """Return all vertices with given key in the graph"""
+    """Return all vertices with given key in the graph
+
+    If graph is a GraphIndex, this is a dictionnary lookup."""
+    if isinstance(graph, GraphIndex):
+        return graph.get_vertices(key, needed_values)
     if not isinstance(needed_values, (list, tuple)):
-        needed = [needed_values]
+        needed_values = [needed_values]
     out = list(filter(lambda v: v.get(key) in needed_values,
                _check_graph(graph).vertices().list()))
     return out
@@ -59,6 +357,8 @@ def get_property_from_vertices(graph, prop, filt=None):
 
     If the property does not exist or is None, it is not returned.
     """
+    if isinstance(graph, GraphIndex) and filt is None:
+        return [val for val in graph.values(prop) if val is not None]
     values_gen = _get_property_from_list_of_dict(
         _check_graph(graph).vertices().list(), prop, filt)
     return list(values_gen)
@@ -75,16 +375,17 @@ def get_property_from_edges(graph, prop, filt=None):
     return list(values_gen)
 
 
-def stack_vertex_buckets(vertex, bck_types=BUCKETS_TYPES):
+def stack_vertex_buckets(vertex, bck_types=BUCKETS_TYPES, dtype=_np.float64):
     """Get and stack all the specified buckets in a graph's vertex
 
-        Coordinates are expressed in millimeters
+        Coordinates are expressed in millimeters.
+        dtype is the data type of the returned array (e.g. numpy.float32).
     """
     vertex_bcks = list()
     for bck_type in bck_types:
         bck = vertex.get(bck_type)
         if bck is not None:
-            bck_np = _convert.bucketMAP_aims_to_ndarray(bck)
+            bck_np = _convert.bucketMAP_aims_to_ndarray(bck, dtype=dtype)
             if len(bck_np) > 0:
                 vertex_bcks.append(bck_np)
     try:
@@ -101,7 +402,7 @@ def list_buckets(graph, key=None, needed_values=None, return_keys=None, defaults
 
         Parameters
         ==========
-        graph: soma.aims.Graph | str
+        graph: soma.aims.Graph | str | GraphIndex
             AIMS Cortical Graph
 
         key: str (opt.)
@@ -160,11 +461,20 @@ def list_buckets(graph, key=None, needed_values=None, return_keys=None, defaults
         raise ValueError(
             "stack_buckets() is now used for graph. Use stack_vertex_buckets instead()")
 
+    index = graph if isinstance(graph, GraphIndex) else None
     graph = _check_graph(graph)
 
     # Select vertices
     if key is None:
         vertices = graph.vertices()
+    elif index is not None:
+        if needed_values is None:
+            positions = [i for i, val in enumerate(index.values(key)) if val]
+        else:
+            positions = index.positions(key, needed_values)
+        point_number = index.values('point_number')
+        vertices = [index.vertices[i] for i in positions
+                    if (point_number[i] or 0) > 0]
     else:
         if needed_values is None:
             vertices = filter(lambda v: v.get(key) and v.get(
@@ -183,26 +493,30 @@ def list_buckets(graph, key=None, needed_values=None, return_keys=None, defaults
             return_keys = [return_keys]
         if not isinstance(defaults, (list, tuple)):
             defaults = [defaults] * len(return_keys)
+        defaults = dict(zip(return_keys, defaults))
         key_values = {k: [] for k in return_keys}
     else:
         key_values = {}
 
-    # Concatenate buckets of all selected vertices, list needed values
-    # and transform them if needed
-    tr_aims = SPACES_TRANSFORMERS[transform](graph)
+    # List buckets of all selected vertices and needed values
     graph_buckets = list()
     for vertex in vertices:
         bck = stack_vertex_buckets(vertex, bck_types=bck_types)
         if bck is None:
             continue
-        bck_tr = tr_aims.transformPoints(bck) if tr_aims else bck
-        if len(bck_tr.shape) < 2:
-            bck_tr = [bck_tr]
-        graph_buckets.append(bck_tr)
+        graph_buckets.append(bck)
         for k in key_values:
             val = vertex.get(k)
             key_values[k].append(defaults[k] if val is None else val)
 
+    # Transform the points of all the buckets at once if needed
+    matrix = get_space_matrix(graph, transform)
+    if matrix is not None and len(graph_buckets) > 0:
+        counts = [len(b) for b in graph_buckets]
+        points = _transform.transform_datapoints(
+            _np.vstack(graph_buckets), affine_matrix=matrix)
+        graph_buckets = _np.split(points, _np.cumsum(counts)[:-1])
+
     # Return a flat vector of bucket points
     if return_keys is not None:
         return graph_buckets, key_values[return_keys[0]] if return_as_list else key_values
@@ -210,6 +524,117 @@ def list_buckets(graph, key=None, needed_values=None, return_keys=None, defaults
         return graph_buckets, {}
 
 
+def columnar_buckets(graph, key=None, needed_values=None, return_keys=None, defaults=None,
+                     transform=None, bck_types=BUCKETS_TYPES, dtype=None):
+    """ List the buckets of the graph as list_buckets() does, in columnar form.
+
+        The parameters are the same as in list_buckets(). dtype is the data type
+        of the points (e.g. numpy.float32). By default the points are not converted.
+
+        Return
+        ======
+        A bucket.ColumnarBuckets with one bucket per selected vertex.
+        Its columns contain the values of the return_keys properties.
+
+        Example
+        =======
+        '''python
+        cb = columnar_buckets(graph, 'name', return_keys='name', transform="Talairach")
+        cb[0], cb.columns['name'][0]
+        '''
+    """
+    if return_keys and not isinstance(return_keys, (list, tuple)):
+        return_keys = [return_keys]
+    graph_buckets, key_values = list_buckets(
+        graph, key, needed_values, return_keys, defaults, transform, bck_types)
+    return _bucket.ColumnarBuckets.from_list(graph_buckets, key_values, dtype=dtype)
+
+
+def label_volume(graph, key='name', needed_values=None, labels=None, transform=None,
+                 bck_types=BUCKETS_TYPES, voxel_size=None, dtype=_np.int16, tight=True):
+    """ Write the buckets of the selected vertices of a graph in one volume of integer labels.
+
+        The points of all the buckets are written in the volume at once. The voxels
+        that are in several buckets take the label of the last one.
+
+        Parameters
+        ==========
+        graph: soma.aims.Graph | str | GraphIndex
+            AIMS Cortical Graph
+
+        key: str (opt.)
+            The vertices are labelled according to the value of this property (e.g. 'name' or 'label').
+
+        needed_values: list | single value (opt.)
+            Select vertices that have key value equal to one of the needed values.
+
+        labels: dict (opt.)
+            {key value: integer label}. The vertices whose value is not in labels are not written.
+            By default the sorted key values are labelled from 1 (0 is the background).
+
+        transform: "ICBM2009c" | "Talairach" | None (opt.)
+            Space of the volume, as in list_buckets().
+
+        bck_types: list of str (opt.)
+            Bucket keys used to list points.
+
+        voxel_size: Sequence[float] (opt.)
+            Voxel size of the volume in mm. Defaults to the voxel size of the graph,
+            or 1 mm if transform is not None.
+
+        dtype: numpy integer type (opt.)
+            Data type of the volume. Default is numpy.int16.
+
+        tight: bool (opt.)
+            If True (default), the volume is the bounding box of the points.
+            Otherwise the volume includes the origin of the coordinates, as AIMS volumes do.
+
+        Return
+        ======
+        A Tuple (volume, offset, labels): the numpy volume, the voxel coordinates
+        of volume[0, 0, 0] and the {key value: integer label} dictionnary.
+        The point p (in mm) is in the voxel round(p / voxel_size) - offset.
+
+        Example
+        =======
+        '''python
+        vol, offset, labels = label_volume(graph, 'label', transform="Talairach", voxel_size=(2, 2, 2))
+        vol[tuple(_np.round(point / 2).astype(int) - offset)] == labels['S.C._left']
+        '''
+    """
+    # read the graph only once (a GraphIndex is kept for the fast vertex selection)
+    if not isinstance(graph, GraphIndex):
+        graph = _check_graph(graph)
+
+    if voxel_size is None:
+        if transform is None:
+            voxel_size = _check_graph(graph)['voxel_size'][:3]
+        else:
+            voxel_size = (1, 1, 1)
+    voxel_size = _np.asarray(voxel_size, dtype=float)[:3]
+
+    buckets = columnar_buckets(graph, key, needed_values, return_keys=key,
+                               transform=transform, bck_types=bck_types)
+    values = buckets.columns[key] if len(buckets) else _np.array([])
+    if labels is None:
+        labels = {val: i + 1 for i, val in enumerate(sorted(set(values.tolist())))}
+    if len(labels) and max(labels.values()) > _np.iinfo(dtype).max:
+        raise ValueError(f"Too many labels for the data type {_np.dtype(dtype)}")
+
+    # label of each bucket, 0 for the vertices that are not labelled
+    bucket_labels = _np.array([labels.get(val, 0) for val in values.tolist()], dtype=dtype)
+    point_labels = _np.repeat(bucket_labels, buckets.counts)
+    voxels = _np.round(buckets.points / voxel_size).astype(int)[point_labels > 0]
+    point_labels = point_labels[point_labels > 0]
+    if len(voxels) == 0:
+        raise ValueError("No bucket points were selected")
+
+    size, offset = _convert._volume_size_from_numpy_bucket(voxels, pad=0, tight=tight)
+    volume = _np.zeros(size, dtype=dtype)
+    _convert._rasterize_numpy_bucket(voxels, volume, offset, value=point_labels)
+    return volume, offset, labels
+
+
 def stack_buckets(graph, key=None, needed_values=None, return_keys=None, defaults=None, transform=None, bck_types=BUCKETS_TYPES):
     """ Stack bucket listed by list_buckets() """
     graph_buckets, key_values = list_buckets(
@@ -228,3 +653,94 @@ def get_bucket_from_graph_by_suclus_name(graph, sulcus_name, ICBM2009c,
     if ICBM2009c is True, the buckets are transformed into the ICBM2009c Template coordinates.
     """
     return stack_buckets(graph, 'name', sulcus_name, "ICBM2009c" if ICBM2009c else None, bck_types)
+
+
+def _parse_arg_value(tokens):
+    """Convert the tokens of an attribute line of a .arg file into int, float, list or str."""
+    values = []
+    for token in tokens:
+        try:
+            values.append(int(token))
+        except ValueError:
+            try:
+                values.append(float(token))
+            except ValueError:
+                return " ".join(tokens)
+    if len(values) == 1:
+        return values[0]
+    return values
+
+
+def read_arg_metadata(path):
+    """Read the attributes of a graph, of its vertices and of its edges from the .arg file only.
+
+    The .arg text file is parsed directly: the buckets and meshes of the .data
+    directory are not loaded, which is much faster than aims.read()
+    when only the attributes (names, labels, sizes, point numbers...) are needed.
+    The values are int, float, lists of numbers or strings.
+
+    Return
+    ======
+    A dictionnary with the keys:
+        syntax: the syntax of the graph (e.g. 'CorticalFoldArg')
+        attributes: dictionnary of the global attributes of the graph
+        vertices: list of the dictionnaries of the attributes of the vertices
+        vertex_syntax: list of the syntax of the vertices (e.g. 'fold')
+        edges: list of the dictionnaries of the attributes of the edges
+        edge_syntax: list of the syntax of the edges (e.g. 'junction')
+        edge_vertices: (n_edges, 2) array of the positions of the vertices of the edges in vertices
+
+    Example
+    =======
+    '''python
+        meta = read_arg_metadata("Lsubject.arg")
+        names = [v.get('name') for v in meta['vertices']]
+        point_numbers = arg_vertex_column(meta, 'point_number', default=0)
+    '''
+    """
+    meta = dict(syntax=None, attributes={}, vertices=[], vertex_syntax=[],
+                edges=[], edge_syntax=[], edge_vertices=[])
+    node_positions = {}
+    current = None
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            tokens = line.split()
+            if len(tokens) == 0 or tokens[0].startswith('#'):
+                continue
+            if tokens[0] == "*BEGIN":
+                element = tokens[1]
+                if element == "GRAPH":
+                    meta['syntax'] = tokens[2] if len(tokens) > 2 else None
+                    current = meta['attributes']
+                elif element == "NODE":
+                    current = {}
+                    node_positions[tokens[3]] = len(meta['vertices'])
+                    meta['vertices'].append(current)
+                    meta['vertex_syntax'].append(tokens[2])
+                elif element == "RELATION":
+                    current = {}
+                    meta['edges'].append(current)
+                    meta['edge_syntax'].append(tokens[2])
+                    meta['edge_vertices'].append(tokens[3:5])
+                else:
+                    raise ValueError(f"{path}: unknown element {element}")
+            elif tokens[0] == "*END":
+                # the attributes following the end of an element belong to the graph
+                current = meta['attributes']
+            elif current is not None:
+                current[tokens[0]] = _parse_arg_value(tokens[1:])
+
+    meta['edge_vertices'] = _np.array(
+        [[node_positions[n1], node_positions[n2]]
+         for n1, n2 in meta['edge_vertices']], dtype=_np.int64).reshape(-1, 2)
+    return meta
+
+
+def arg_vertex_column(meta, key, default=_np.nan):
+    """Return the values of a vertex attribute read by read_arg_metadata() as a numpy array.
+
+    meta can also be the path of the .arg file. Undefined values are replaced by default.
+    """
+    if isinstance(meta, str):
+        meta = read_arg_metadata(meta)
+    return _np.array([v.get(key, default) for v in meta['vertices']])
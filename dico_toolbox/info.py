@@ -44,6 +44,7 @@ EXTRA_REQUIRES = {
 ENTRYPOINTS = {
     'console_scripts': [
         'dtb_volume_to_point_cloud=dico_toolbox.cli.volume_to_point_cloud:main',
+        'dtb_graphs_to_point_clouds=dico_toolbox.cli.graphs_to_point_clouds:main',
         'nb2md=dico_toolbox.cli.notebook2markdown:main'
     ],
 }
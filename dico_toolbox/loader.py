@@ -0,0 +1,109 @@
+# [treesource] prefetching loader of database files
+import time as _time
+from collections import deque as _deque, namedtuple as _namedtuple
+from itertools import islice as _islice
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
+import numpy as _np
+from soma import aims as _aims
+from . import convert as _convert
+from . import graph as _graph
+from . import database as _database
+from .wrappers import PyMesh as _PyMesh
+
+import logging
+log = logging.getLogger(__name__)
+
+
+Loaded = _namedtuple("Loaded", ["path", "data", "load_time"])
+Loaded.__doc__ = """A loaded file: its path, its content and the time spent to read (and convert) it, in seconds."""
+
+
+def to_numpy(obj):
+    """Convert an aims object into numpy arrays or python objects.
+
+    - volumes are converted into 3D numpy arrays (copies)
+    - meshes are converted into wrappers.PyMesh
+    - bucket maps are converted into (N,3) arrays of coordinates in mm
+    - graphs are converted into a bucket.ColumnarBuckets of the buckets of the named vertices,
+      with their names in the 'name' column (see graph.columnar_buckets())
+
+    Other objects are returned unchanged.
+    """
+    type_name = type(obj).__name__
+    if isinstance(obj, _aims.Graph):
+        return _graph.columnar_buckets(obj, 'name', return_keys='name')
+    if type_name.startswith(("Volume_", "rc_ptr_Volume_")):
+        return _np.array(_convert.volume_to_ndarray(obj))
+    if type_name.startswith(("AimsTimeSurface", "rc_ptr_AimsTimeSurface")):
+        return _PyMesh(obj)
+    if type_name in ("BucketMap_VOID", "rc_ptr_BucketMap_VOID"):
+        return _convert.bucketMAP_aims_to_ndarray(obj)
+    return obj
+
+
+def prefetch_load(paths, loader=_aims.read, prefetch=4, n_jobs=None, numpy=False, **query):
+    """Load files one after the other while the next ones are read in background threads.
+
+    The files are yielded in the order of paths. At most prefetch files are read
+    in advance, so that at most prefetch + 1 loaded files are kept in memory
+    (the prefetched ones and the one being processed).
+
+    Args:
+        paths (list of str | database.FileDatabase): the paths of the files, or a database.
+        loader (callable, optional): function reading a file. Defaults to aims.read.
+        prefetch (int, optional): number of files read in advance. Defaults to 4.
+        n_jobs (int, optional): number of reading threads. Defaults to prefetch.
+        numpy (bool | callable, optional): if True, the loaded objects are converted
+            by to_numpy() in the reading threads. A conversion function can also be given.
+
+        If paths is a database, the other keyword arguments are used to query the files
+        (e.g. type='graph', subject=['001', '002']).
+
+    Yields:
+        Loaded: named tuple (path, data, load_time).
+
+    Example
+    =======
+    '''python
+        db = BVDatabase("/path/to/the/database")
+        for path, graph, load_time in prefetch_load(db, type="graph", graph_session="session1_manual"):
+            process(graph)
+    '''
+    """
+    if isinstance(paths, _database.FileDatabase):
+        paths = paths.get(**query)
+    elif len(query) > 0:
+        raise ValueError("Queries can only be used with a database.")
+    if prefetch < 1:
+        raise ValueError("prefetch must be at least 1")
+
+    if numpy is True:
+        convert = to_numpy
+    elif callable(numpy):
+        convert = numpy
+    else:
+        convert = None
+
+    def load(path):
+        start = _time.perf_counter()
+        data = loader(path)
+        if convert is not None:
+            data = convert(data)
+        return Loaded(path, data, _time.perf_counter() - start)
+
+    paths = iter(paths)
+    with _ThreadPoolExecutor(max_workers=n_jobs or prefetch) as executor:
+        futures = _deque(executor.submit(load, path)
+                         for path in _islice(paths, prefetch))
+        try:
+            while futures:
+                loaded = futures.popleft().result()
+                # keep the number of files in flight constant
+                for path in _islice(paths, 1):
+                    futures.append(executor.submit(load, path))
+                log.debug(f"{loaded.path} loaded in {loaded.load_time:.3f} s")
+                yield loaded
+        finally:
+            # the iteration has been stopped: do not read the pending files
+            for future in futures:
+                future.cancel()
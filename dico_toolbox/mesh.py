@@ -1,7 +1,9 @@
 # [treesource] PyAims Mesh manipulation
 from soma import aims as _aims
 import numpy as _np
+from scipy import sparse as _sparse
 from . import transform as _transform
+from .wrappers import PyMesh as _PyMesh, PyMeshFrame as _PyMeshFrame
 
 
 def rescale_mesh(mesh, dxyz):
@@ -124,4 +126,139 @@ def apply_Talairach_to_mesh(mesh, dxyz, rotation, translation, flip=False):
     if flip:
         flip_mesh(mesh)
 
-    return mesh
\ No newline at end of file
+    return mesh
+
+
+def compute_normals(vertices, polygons):
+    """Return the unit normals of the vertices of a triangle mesh.
+
+    The normal of a vertex is the sum of the normals of its triangles,
+    weighted by their area.
+
+    Args:
+        vertices (numpy.ndarray): (N,3) vertices coordinates
+        polygons (numpy.ndarray): (M,3) vertex indices of the triangles
+    """
+    v0, v1, v2 = (vertices[polygons[:, i]] for i in range(3))
+    face_normals = _np.cross(v1 - v0, v2 - v0)
+    normals = _np.zeros((len(vertices), 3))
+    for i in range(3):
+        for axis in range(3):
+            normals[:, axis] += _np.bincount(
+                polygons[:, i], weights=face_normals[:, axis], minlength=len(vertices))
+    norm = _np.linalg.norm(normals, axis=1, keepdims=True)
+    norm[norm == 0] = 1
+    return normals / norm
+
+
+def _laplacian_operator(polygons, n_vertices):
+    """Sparse (n_vertices, n_vertices) matrix that averages the neighbours of each vertex.
+
+    The neighbours are the vertices connected by an edge of the triangles.
+    Isolated vertices are their own neighbour.
+    """
+    edges = _np.vstack([polygons[:, [0, 1]], polygons[:, [1, 2]], polygons[:, [2, 0]]])
+    edges = _np.vstack([edges, edges[:, ::-1]])
+    adjacency = _sparse.coo_matrix(
+        (_np.ones(len(edges)), (edges[:, 0], edges[:, 1])),
+        shape=(n_vertices, n_vertices)).tocsr()
+    # the same edge is shared by two triangles
+    adjacency.data[:] = 1
+    degree = _np.asarray(adjacency.sum(axis=1)).ravel()
+    isolated = degree == 0
+    adjacency = adjacency + _sparse.diags(isolated.astype(float))
+    degree[isolated] = 1
+    return _sparse.diags(1/degree) @ adjacency
+
+
+def _smooth_vertices(vertices, operator, iterations, rate):
+    """Laplacian smoothing: at each iteration every vertex moves of rate times
+    the vector that joins it to the barycenter of its neighbours."""
+    vertices = _np.asarray(vertices, dtype=float)
+    for _ in range(iterations):
+        vertices = vertices + rate*(operator @ vertices - vertices)
+    return vertices
+
+
+class LaplacianSmoother:
+    """Laplacian smoothing of the vertices of meshes that share the same triangles.
+
+    The sparse Laplacian operator is built once from the polygons, then each
+    smoothing iteration is a sparse matrix product over the vertices.
+
+    Example
+    =======
+    '''python
+        smoother = LaplacianSmoother(pymesh.polygons)
+        vertices = smoother(pymesh.vertices, iterations=30, rate=0.4)
+    '''
+    """
+
+    def __init__(self, polygons, n_vertices=None):
+        """
+        Args:
+            polygons (numpy.ndarray): (M,3) vertex indices of the triangles
+            n_vertices (int, optional): number of vertices. Defaults to the largest index in polygons + 1.
+        """
+        polygons = _np.asarray(polygons, dtype=int)
+        if n_vertices is None:
+            n_vertices = polygons.max() + 1 if len(polygons) > 0 else 0
+        self.operator = _laplacian_operator(polygons, n_vertices)
+
+    def __call__(self, vertices, iterations=30, rate=0.4):
+        """Return the smoothed vertices (the input is not modified)."""
+        return _smooth_vertices(vertices, self.operator, iterations, rate)
+
+
+def smooth_pymesh(meshes, iterations=30, rate=0.4):
+    """Smooth all the frames of one or several PyMesh with a Laplacian filter.
+
+    All the frames are smoothed together: their operators are assembled in one
+    block-diagonal sparse matrix, so that each iteration is a single matrix product
+    for the whole batch. Frames that share the same polygons array share the
+    same operator.
+
+    Args:
+        meshes (PyMesh or list of PyMesh): the meshes to smooth. They are not modified.
+        iterations (int, optional): number of iterations. Defaults to 30.
+        rate (float, optional): smoothing rate, in [0,1]. Defaults to 0.4.
+
+    Returns:
+        PyMesh or list of PyMesh: new smoothed meshes, with updated normals.
+    """
+    single = isinstance(meshes, _PyMesh)
+    if single:
+        meshes = [meshes]
+
+    frames = [frame for mesh in meshes for frame in mesh.frames]
+    operators = {}
+    for frame in frames:
+        key = id(frame.polygons)
+        if key not in operators:
+            operators[key] = _laplacian_operator(
+                _np.asarray(frame.polygons, dtype=int), len(frame.vertices))
+    operator = _sparse.block_diag(
+        [operators[id(frame.polygons)] for frame in frames], format='csr')
+
+    sizes = [len(frame.vertices) for frame in frames]
+    vertices = _smooth_vertices(
+        _np.vstack([frame.vertices for frame in frames]), operator, iterations, rate)
+    vertices = _np.split(vertices, _np.cumsum(sizes)[:-1])
+
+    smoothed = []
+    i = 0
+    for mesh in meshes:
+        new_mesh = _PyMesh()
+        new_mesh.header = mesh.header
+        new_mesh.frames = []
+        for frame in mesh.frames:
+            new_frame = _PyMeshFrame()
+            new_frame.vertices = vertices[i]
+            new_frame.polygons = frame.polygons
+            new_frame.normals = compute_normals(vertices[i], frame.polygons)
+            new_frame.header = frame.header
+            new_mesh.append(new_frame)
+            i += 1
+        smoothed.append(new_mesh)
+
+    return smoothed[0] if single else smoothed
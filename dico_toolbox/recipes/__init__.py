@@ -1 +1 @@
-from .meshes import mesh_of_average, mesh_of_averages, mesh_one_point_cloud, mesh_of_point_clouds, shift_meshes_in_embedding
+from .meshes import mesh_of_average, mesh_of_averages, mesh_one_point_cloud, mesh_packed_point_clouds, mesh_of_point_clouds, shift_meshes_in_embedding
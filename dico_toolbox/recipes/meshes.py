@@ -1,9 +1,11 @@
 from multiprocessing import Pool, cpu_count
 from .. mesh import shift_aims_mesh, transform_mesh_inplace, apply_Talairach_to_mesh, flip_mesh, transform_mesh
-from ..convert import volume_to_mesh, bucket_to_mesh
+from ..convert import volume_to_mesh, bucket_to_mesh, _gaussian_radius
 from ..wrappers import PyMesh
 import numpy as np
 from tqdm import tqdm
+import logging
+log = logging.getLogger(__name__)
 
 
 class Average_result:
@@ -63,6 +65,21 @@ def mesh_of_averages(average_results, in_embedding=False, embedding_scale=1, **m
     return {k: mesh_of_average(v, in_embedding, embedding_scale, **meshing_parameters) for k, v in average_results.items()}
 
 
+def _transform_point_cloud_mesh(mesh, tal, flip, align):
+    """Apply the pre-transformation, flip and post-transformation to a mesh"""
+    # Talairach transform
+    if tal is not None:
+        mesh = apply_Talairach_to_mesh(
+            mesh, tal['dxyz'], tal['rot'], tal['tra'], flip=False)
+    if flip:
+        flip_mesh(mesh)
+    # apply alignment
+    if align is not None:
+        mesh = transform_mesh(
+            mesh, rot_matrix=align['rot'],  transl_vec=align['tra'])
+    return mesh
+
+
 def mesh_one_point_cloud(data):
     """build one mesh. This function is adapted for multiprocessing"""
     # unpack data
@@ -75,22 +92,93 @@ def mesh_one_point_cloud(data):
 
     # generate mesh
     mesh = bucket_to_mesh(pc, **meshing_parameters)
-    # Talairach transform
-    if tal is not None:
-        mesh = apply_Talairach_to_mesh(
-            tal['dxyz'], tal['rot'], tal['tra'], flip=False)
-    if flip:
-        mesh = flip_mesh(mesh)
-    # apply alignment
-    if align is not None:
-        mesh = transform_mesh(
-            mesh, rot_matrix=align['rot'],  transl_vec=align['tra'])
+    mesh = _transform_point_cloud_mesh(mesh, tal, flip, align)
     # convert to dictionnary
     mesh_dict = PyMesh(mesh).to_dict()
 
     return {"name": name, "mesh": mesh_dict}
 
 
+def _pack_point_clouds(pcs, spacing):
+    """Place the point clouds side by side along the x axis, separated by spacing voxels.
+
+    Returns:
+        packed (ndarray): the (N,3) concatenation of the shifted point clouds
+        shifts (ndarray): (n,3) vectors that bring each packed point cloud back to its position
+        starts (ndarray): the x coordinate where each point cloud starts in packed
+    """
+    pcs = [np.round(pc).astype(int) for pc in pcs]
+    mins = np.array([pc.min(axis=0) for pc in pcs])
+    widths = np.array([pc[:, 0].max() - pc[:, 0].min() + 1 for pc in pcs])
+    starts = np.concatenate([[0], np.cumsum(widths + spacing)[:-1]])
+
+    shifts = mins.copy()
+    shifts[:, 0] -= starts
+    packed = np.vstack([pc - shift for pc, shift in zip(pcs, shifts)])
+    return packed, shifts, starts
+
+
+def _split_packed_mesh(mesh, starts, spacing):
+    """Split the mesh of packed point clouds.
+
+    Each vertex is assigned to the slot of the point cloud it is closest to along x,
+    each polygon to the slot of its first vertex.
+
+    Yields:
+        Tuple (index of the point cloud, vertices, polygons)
+    """
+    vertices = mesh.vertices
+    polygons = mesh.polygons
+    boundaries = starts - spacing/2
+    vertex_slots = np.searchsorted(boundaries, vertices[:, 0], side='right') - 1
+    polygon_slots = vertex_slots[polygons[:, 0]]
+
+    for i in range(len(starts)):
+        slot_polygons = polygons[polygon_slots == i]
+        if len(slot_polygons) == 0:
+            continue
+        used, new_polygons = np.unique(slot_polygons, return_inverse=True)
+        yield i, vertices[used], new_polygons.reshape(slot_polygons.shape)
+
+
+def mesh_packed_point_clouds(data):
+    """build the meshes of several point clouds by packing them into one volume.
+    This function is adapted for multiprocessing"""
+    # unpack data
+    names = data['names']
+    pcs = data['pcs']
+    tal = data["talairach"]
+    flip = data['flip']
+    align = data["align"]
+    meshing_parameters = data['meshing_parameters']
+
+    threshold = meshing_parameters.get('threshold', 1)
+    if isinstance(threshold, str):
+        raise ValueError(
+            "Packed point clouds can not be meshed with a percentage threshold.")
+
+    # leave enough room between the point clouds so that the blurred volumes do not touch
+    spacing = 2*(_gaussian_radius(meshing_parameters.get('gblur_sigma', 0)) + 2) + 1
+    packed, shifts, starts = _pack_point_clouds(pcs, spacing)
+
+    # generate one mesh for all the point clouds and split it
+    meshing_parameters = dict(meshing_parameters, tight=True)
+    mesh = PyMesh(bucket_to_mesh(packed, **meshing_parameters))
+
+    results = []
+    for i, vertices, polygons in _split_packed_mesh(mesh, starts, spacing):
+        piece = PyMesh()
+        piece.from_elements(vertices + shifts[i], polygons, None)
+        piece = _transform_point_cloud_mesh(
+            piece.to_aims_mesh(), tal, flip, align)
+        results.append({"name": names[i], "mesh": PyMesh(piece).to_dict()})
+
+    if len(results) < len(names):
+        log.warning(f"{len(names) - len(results)} point-cloud(s) have an empty mesh.")
+
+    return results
+
+
 def _parse_pool_result(res):
     name = res['name']
     mesh = PyMesh()
@@ -109,7 +197,8 @@ def _parse_pool_results(results):
     return meshes
 
 
-def mesh_of_point_clouds(pcs, pre_transformation=None, flip=False, post_transformation=None, **meshing_parameters):
+def mesh_of_point_clouds(pcs, pre_transformation=None, flip=False, post_transformation=None,
+                         pack=False, pack_size=256, **meshing_parameters):
     """Build the mesh of the pointclouds.
 
     Args:
@@ -117,25 +206,50 @@ def mesh_of_point_clouds(pcs, pre_transformation=None, flip=False, post_transfor
         pre_transformation (collection of dict, optional): This transformation is applied before flip. keys = {dxy, rot, tra}. Defaults to None.
         flip (bool, optional): flip the data. Defaults to False.
         post_transformation (collection of dict, optional): This transformation is applied after flip. keys = {rot, tra}. Defaults to None.
+        pack (bool, optional): pack up to pack_size point clouds in one volume which is meshed at once,
+            then split the mesh. This is much faster for many small point clouds.
+            The volume is normalized as a whole, so that the threshold must be a float (not a percentage),
+            and with gblur_sigma > 0 the result can differ from meshing each point cloud separately.
+            Defaults to False.
+        pack_size (int, optional): maximum number of point clouds in a packed volume. Defaults to 256.
 
     Returns:
-        _type_: _description_
+        dict: {name:aims_mesh}
     """
-    data = []
-    for name, pc in pcs.items():
-        data.append(dict(
-            name=name,
-            pc=pc,
-            talairach=pre_transformation,  # {dxy, rot, tra}
-            flip=flip,
-            align=post_transformation,  # {rot, tra},
-            meshing_parameters=meshing_parameters
-        ))
+    if pack:
+        names = list(pcs.keys())
+        data = []
+        for i in range(0, len(names), pack_size):
+            chunk = names[i:i+pack_size]
+            data.append(dict(
+                names=chunk,
+                pcs=[pcs[name] for name in chunk],
+                talairach=pre_transformation,  # {dxy, rot, tra}
+                flip=flip,
+                align=post_transformation,  # {rot, tra},
+                meshing_parameters=meshing_parameters
+            ))
+        fun = mesh_packed_point_clouds
+    else:
+        data = []
+        for name, pc in pcs.items():
+            data.append(dict(
+                name=name,
+                pc=pc,
+                talairach=pre_transformation,  # {dxy, rot, tra}
+                flip=flip,
+                align=post_transformation,  # {rot, tra},
+                meshing_parameters=meshing_parameters
+            ))
+        fun = mesh_one_point_cloud
 
     with Pool(cpu_count()-3) as pool:
-        res = list(tqdm(pool.imap(mesh_one_point_cloud, data),
+        res = list(tqdm(pool.imap(fun, data),
                    total=len(data), desc="meshing..."))
 
+    if pack:
+        res = [r for chunk_res in res for r in chunk_res]
+
     # aims objects can not be pickled; the result parsing can not be parallelized with multiprocessing
         res = _parse_pool_results(res)
 
@@ -0,0 +1,291 @@
+# [treesource] binary sidecar cache of parsed graphs
+import os
+import os.path as _op
+import json as _json
+import struct as _struct
+import zipfile as _zipfile
+import numpy as _np
+from . import graph as _graph
+from . import bucket as _bucket
+from . import convert as _convert
+
+import logging
+log = logging.getLogger(__name__)
+
+SIDECAR_VERSION = 1
+# the files with this extension are ignored by database.FileDatabase
+SIDECAR_EXTENSION = ".dtb.npz"
+DEFAULT_CACHE_DIR = _op.join(
+    os.environ.get("XDG_CACHE_HOME", _op.expanduser(_op.join("~", ".cache"))), "dico_toolbox")
+
+
+def sidecar_path(arg_path, cache_dir=None, next_to_graph=False):
+    """Return the default path of the sidecar file of a graph.
+
+    The sidecar is in cache_dir (default: DEFAULT_CACHE_DIR), under the absolute path
+    of the .arg file. If next_to_graph is True, it is next to the .arg file instead."""
+    path = _op.realpath(arg_path) + SIDECAR_EXTENSION
+    if not next_to_graph:
+        cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else cache_dir
+        path = _op.join(cache_dir, path.lstrip(os.sep))
+    return path
+
+
+def graph_signature(arg_path):
+    """Return a signature of the .arg file and of its .data directory.
+
+    The signature changes when the .arg file or any file of the .data directory
+    is modified, added or removed."""
+    stat = os.stat(arg_path)
+    n_files = 0
+    total_size = 0
+    last_mtime = 0
+    data_dir = _op.splitext(arg_path)[0] + ".data"
+    stack = [data_dir] if _op.isdir(data_dir) else []
+    while stack:
+        directory = stack.pop()
+        last_mtime = max(last_mtime, os.stat(directory).st_mtime_ns)
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                else:
+                    entry_stat = entry.stat()
+                    n_files += 1
+                    total_size += entry_stat.st_size
+                    last_mtime = max(last_mtime, entry_stat.st_mtime_ns)
+    return {"arg": [stat.st_mtime_ns, stat.st_size],
+            "data": [n_files, total_size, last_mtime]}
+
+
+def _vertex_columns(index):
+    """Return a dictionnary {attribute: numpy array} of the attributes of the vertices
+    whose values are numbers, strings or fixed-length sequences of numbers.
+    Missing numeric values are NaN, missing strings are empty."""
+    keys = set()
+    for v in index.vertices:
+        keys.update(v.keys())
+
+    columns = {}
+    for key in sorted(keys):
+        values = index.values(key)
+        defined = [val for val in values if val is not None]
+        try:
+            if all(isinstance(val, str) for val in defined):
+                column = _np.array(
+                    ['' if val is None else val for val in values], dtype=str)
+            else:
+                array = _np.array(defined, dtype=float)
+                if array.ndim > 2:
+                    continue
+                column = _np.full((len(values),) + array.shape[1:], _np.nan)
+                column[[val is not None for val in values]] = array
+                if not _np.isnan(column).any() and _np.array_equal(column, _np.round(column)):
+                    column = column.astype(_np.int64)
+        except (TypeError, ValueError):
+            # buckets, meshes, lists of different lengths...
+            continue
+        columns[key] = column
+    return columns
+
+
+def _vertex_bucket_tables(index, bck_types):
+    """Return a dictionnary {bck_type: ColumnarBuckets} of the unscaled buckets of all
+    the vertices (one bucket per vertex) and the voxel size."""
+    voxel_size = None
+    tables = {}
+    for bck_type in bck_types:
+        buckets = []
+        for v in index.vertices:
+            bck = v.get(bck_type)
+            if bck is None:
+                buckets.append(_np.empty((0, 3), dtype=_np.int16))
+                continue
+            if voxel_size is None:
+                voxel_size = list(bck.header()['voxel_size'][:3])
+            buckets.append(_convert.bucketMAP_aims_to_ndarray(
+                bck, scaled=False, dtype=_np.int16).reshape(-1, 3))
+        tables[bck_type] = _bucket.ColumnarBuckets.from_list(
+            buckets, dtype=_np.int16)
+    return tables, voxel_size or [1., 1., 1.]
+
+
+def export_graph_sidecar(arg_path, path=None, bck_types=_graph.BUCKETS_TYPES, graph=None):
+    """Save the vertex attributes, the buckets and the edges of a graph in one binary file.
+
+    The file is an uncompressed .npz that can be memory-mapped by load_graph_sidecar().
+
+    Args:
+        arg_path (str): path of the .arg file.
+        path (str, optional): path of the sidecar file. Defaults to sidecar_path(arg_path).
+        bck_types (list of str, optional): the buckets to store. Defaults to graph.BUCKETS_TYPES.
+        graph (soma.aims.Graph, optional): the graph read from arg_path, if it is already loaded.
+
+    Returns:
+        str: the path of the sidecar file
+    """
+    if path is None:
+        path = sidecar_path(arg_path)
+    signature = graph_signature(arg_path)
+    index = _graph.GraphIndex(arg_path if graph is None else graph)
+
+    arrays = {}
+    columns = _vertex_columns(index)
+    for key, column in columns.items():
+        arrays["vertex/" + key] = column
+
+    tables, voxel_size = _vertex_bucket_tables(index, bck_types)
+    for bck_type, table in tables.items():
+        arrays["bucket/" + bck_type + "/points"] = table.points
+        arrays["bucket/" + bck_type + "/offsets"] = table.offsets
+
+    for key, column in _graph.edge_table(index).items():
+        arrays["edge/" + key] = column
+
+    meta = dict(version=SIDECAR_VERSION, source=_op.realpath(arg_path),
+                signature=signature, voxel_size=voxel_size,
+                bck_types=list(bck_types), n_vertices=len(index))
+    arrays["meta"] = _np.frombuffer(
+        _json.dumps(meta).encode(), dtype=_np.uint8)
+
+    d = _op.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    # write in a temporary file so that a partial file is never read
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        _np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _memmap_npz(path):
+    """Memory-map all the arrays of an uncompressed .npz file (read-only)."""
+    arrays = {}
+    with _zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            if info.compress_type != _zipfile.ZIP_STORED:
+                raise ValueError(f"{path} is compressed and can not be memory-mapped.")
+            # skip the local file header
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = _struct.unpack("<HH", f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            # read the .npy header
+            version = _np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = _np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = _np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject:
+                raise ValueError("Arrays of python objects can not be memory-mapped.")
+            name = info.filename[:-len(".npy")]
+            if _np.prod(shape) == 0:
+                arrays[name] = _np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = _np.memmap(path, dtype=dtype, mode="r", offset=f.tell(),
+                                          shape=shape, order="F" if fortran else "C")
+    return arrays
+
+
+class GraphSidecar:
+    """Read-only, memory-mapped content of a graph sidecar file.
+
+    Attributes:
+        vertices (dict): {attribute: numpy array} with one value per vertex.
+        bucket_tables (dict): {bck_type: bucket.ColumnarBuckets} of the unscaled buckets of the vertices.
+        edges (dict): the graph.edge_table() of the graph. source and target are vertex positions.
+        meta (dict): voxel_size, bck_types, signature of the source graph...
+    """
+
+    def __init__(self, path):
+        self.path = path
+        arrays = _memmap_npz(path)
+        self.meta = _json.loads(bytes(arrays.pop("meta")).decode())
+        self.vertices = {k[len("vertex/"):]: v for k, v in arrays.items()
+                         if k.startswith("vertex/")}
+        self.edges = {k[len("edge/"):]: v for k, v in arrays.items()
+                      if k.startswith("edge/")}
+        self.bucket_tables = {
+            bck_type: _bucket.ColumnarBuckets(
+                arrays["bucket/" + bck_type + "/points"],
+                arrays["bucket/" + bck_type + "/offsets"])
+            for bck_type in self.meta["bck_types"]}
+
+    def __len__(self):
+        return self.meta["n_vertices"]
+
+    def __repr__(self):
+        return f"GraphSidecar of {len(self)} vertices ({self.meta['source']})"
+
+    @property
+    def voxel_size(self):
+        return _np.array(self.meta["voxel_size"])
+
+    def is_valid(self, arg_path=None):
+        """Return True if the source graph did not change since the sidecar was saved."""
+        arg_path = arg_path or self.meta["source"]
+        try:
+            return graph_signature(arg_path) == self.meta["signature"]
+        except FileNotFoundError:
+            return False
+
+    def buckets(self, bck_types=None, scaled=True):
+        """Return a bucket.ColumnarBuckets with the stacked buckets of each vertex
+        (one bucket per vertex, in the order of the vertices columns).
+
+        If scaled is True, the coordinates are in millimeters, as in graph.stack_vertex_buckets().
+        """
+        bck_types = self.meta["bck_types"] if bck_types is None else bck_types
+        tables = [self.bucket_tables[t] for t in bck_types]
+        if len(tables) == 0:
+            raise ValueError("bck_types is empty")
+        points = _np.concatenate([t.points for t in tables])
+        vertex_ids = _np.concatenate([t.bucket_indices() for t in tables])
+        # stable sort: the types stay in the order of bck_types for each vertex
+        order = _np.argsort(vertex_ids, kind="stable")
+        counts = _np.bincount(vertex_ids, minlength=len(self))
+        offsets = _np.concatenate([[0], _np.cumsum(counts)])
+        points = points[order]
+        if scaled:
+            points = points * self.voxel_size
+        return _bucket.ColumnarBuckets(points, offsets, self.vertices)
+
+
+def load_graph_sidecar(path, arg_path=None, check=True):
+    """Open a sidecar file with memory-mapping.
+
+    If check is True and the source graph (arg_path, or the path stored in the sidecar)
+    changed since the sidecar was saved, None is returned."""
+    sidecar = GraphSidecar(path)
+    if check and not sidecar.is_valid(arg_path):
+        return None
+    return sidecar
+
+
+def read_graph_sidecar(arg_path, cache_dir=None, bck_types=_graph.BUCKETS_TYPES, next_to_graph=False):
+    """Return the GraphSidecar of a graph, (re)creating the sidecar file if it is missing or outdated.
+
+    The sidecar file is in cache_dir (default: DEFAULT_CACHE_DIR), or next to the .arg file
+    if next_to_graph is True (see sidecar_path()).
+
+    Example
+    =======
+    '''python
+        sc = read_graph_sidecar("/path/to/Lsubject.arg")
+        names = sc.vertices['name']
+        buckets = sc.buckets()
+    '''
+    """
+    path = sidecar_path(arg_path, cache_dir, next_to_graph)
+    sidecar = None
+    if _op.exists(path):
+        try:
+            sidecar = load_graph_sidecar(path, arg_path)
+        except (ValueError, KeyError, OSError) as e:
+            log.warning(f"Invalid sidecar file {path}: {e}")
+        if sidecar is not None and not set(bck_types) <= set(sidecar.meta["bck_types"]):
+            sidecar = None
+    if sidecar is None:
+        export_graph_sidecar(arg_path, path, bck_types)
+        sidecar = load_graph_sidecar(path, check=False)
+    return sidecar
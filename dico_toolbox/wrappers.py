@@ -135,48 +135,98 @@ class PyMeshFrame:
         return "PyMeshFrame of {} triangles\n".format(ln)
 
 
-class AimsObjAttribute:
-    def __init__(self):
-        pass
+class pyVertex:
+    """Access the attributes of an aims graph vertex as python attributes (e.g. vertex.name).
 
+    The value of an attribute is read from the aims vertex at its first access,
+    then cached. Call clear_cache() if the aims vertex is modified.
+    """
+    __slots__ = ("aims_obj", "_keys", "_cache")
 
-class pyVertex:
     def __init__(self, aimsVertex):
         self.aims_obj = aimsVertex
-        aa = AimsObjAttribute()
-
-        for k in self.aims_obj.keys():
-            self.__dict__[k] = aa
+        self._keys = None
+        self._cache = {}
 
     def to_aims(self):
         return self.aims_obj
 
-    def __getattribute__(self, name):
-        val = object.__getattribute__(self, name)
+    def keys(self):
+        """Return the names of the attributes of the vertex."""
+        if self._keys is None:
+            self._keys = frozenset(self.aims_obj.keys())
+        return self._keys
 
-        if isinstance(val, AimsObjAttribute):
-            val = self.aims_obj.get(name)
+    def clear_cache(self):
+        self._keys = None
+        self._cache.clear()
 
+    def __getattr__(self, name):
+        # only called when the normal lookup fails, i.e. for the aims attributes
+        if name in pyVertex.__slots__:
+            raise AttributeError(name)
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+        if name not in self.keys():
+            raise AttributeError(f"the vertex has no attribute '{name}'")
+        val = self.aims_obj.get(name)
+        self._cache[name] = val
         return val
 
+    def __dir__(self):
+        return sorted(set(object.__dir__(self)) | self.keys())
+
     def __repr__(self):
         return f"{self.name}"
 
 
 class pyGraph:
+    """Access the attributes of an aims graph as python attributes (e.g. graph.voxel_size).
+
+    The vertices are wrapped in pyVertex objects at the first access to pyGraph.vertices.
+    The other attributes and methods are those of the aims graph.
+    """
+
     def __init__(self, aimsGraph):
         assert(isinstance(aimsGraph, _aims.Graph))
         self.aims_obj = aimsGraph
-        for k, v in self.aims_obj.items():
-            self.__dict__[k] = v
-        self.vertices = [pyVertex(v) for v in aimsGraph.vertices().list()]
-        self.aimsvertices = aimsGraph.vertices().list()
+        self._keys = frozenset(aimsGraph.keys())
+        self._cache = {}
+        self._aimsvertices = None
+        self._vertices = None
 
     def to_aims(self):
         return self.aims_obj
 
+    @property
+    def aimsvertices(self):
+        if self._aimsvertices is None:
+            self._aimsvertices = self.aims_obj.vertices().list()
+        return self._aimsvertices
+
+    @property
+    def vertices(self):
+        if self._vertices is None:
+            self._vertices = [pyVertex(v) for v in self.aimsvertices]
+        return self._vertices
+
     def __getattr__(self, name):
-        return eval(f"self.aims_obj.{name}")
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+        if name in self._keys:
+            val = self.aims_obj.get(name)
+            self._cache[name] = val
+            return val
+        return getattr(self.aims_obj, name)
+
+    def __dir__(self):
+        return sorted(set(object.__dir__(self)) | self._keys)
 
     def __repr__(self):
-        return f"pyGraph of {len(self.vertices)} vertices"
+        return f"pyGraph of {len(self.aimsvertices)} vertices"
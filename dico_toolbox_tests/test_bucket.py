@@ -0,0 +1,31 @@
+import os
+import numpy as np
+import pytest
+import dico_toolbox as dtb
+
+
+def test_columnar_buckets(tmp_path):
+    buckets = [np.zeros((3, 3)), np.ones((0, 3)), np.arange(6).reshape(2, 3)]
+    cb = dtb.bucket.ColumnarBuckets.from_list(
+        buckets, columns={'name': ['a', 'b', 'c'], 'size': [3, 0, 2]})
+
+    assert len(cb) == 3
+    assert np.array_equal(cb.counts, [3, 0, 2])
+    assert np.array_equal(cb.bucket_indices(), [0, 0, 0, 2, 2])
+    for b, expected in zip(cb, buckets):
+        assert np.array_equal(b, expected)
+    # buckets are views on the points
+    assert cb[2].base is cb.points or cb[2].base is cb.points.base
+    assert np.array_equal(cb[-1], buckets[-1])
+    with pytest.raises(IndexError):
+        cb[3]
+
+    path = os.path.join(tmp_path, "buckets.npz")
+    cb.save(path)
+    loaded = dtb.bucket.ColumnarBuckets.load(path)
+    assert np.array_equal(loaded.points, cb.points)
+    assert np.array_equal(loaded.offsets, cb.offsets)
+    assert list(loaded.columns['name']) == ['a', 'b', 'c']
+
+    with pytest.raises(ValueError):
+        dtb.bucket.ColumnarBuckets.from_list(buckets, columns={'name': ['a']})
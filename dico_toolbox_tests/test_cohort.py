@@ -0,0 +1,33 @@
+import os
+import numpy as np
+import dico_toolbox as dtb
+from dico_toolbox.cohort import graph_identifiers
+
+
+def test_graph_identifiers():
+    assert graph_identifiers(
+        "/db/center/sub-01/t1mri/default_acquisition/default_analysis/folds/3.1/Lsub-01.arg") == ("sub-01", "left")
+    assert graph_identifiers("/data/Rsub-02.arg") == ("sub-02", "right")
+    assert graph_identifiers("/data/graph.arg") == ("graph", None)
+
+
+def test_extract_cohort_buckets(tmp_path):
+    db = dtb.test_data.bv_database()
+    out_path = os.path.join(tmp_path, "buckets.npz")
+    keys, errors = dtb.cohort.extract_cohort_buckets(
+        db, out_path, n_jobs=2, graph_session="session1_manual")
+    assert len(errors) == 0
+    assert len(keys) > 0
+    with np.load(out_path) as f:
+        assert sorted(f.files) == sorted(keys)
+        assert f[keys[0]].shape[1] == 3
+
+
+def test_extract_cohort_buckets_default_query(tmp_path):
+    db = dtb.test_data.bv_database()
+    out_path = os.path.join(tmp_path, "buckets.npz")
+    keys, errors = dtb.cohort.extract_cohort_buckets(db, out_path, n_jobs=2)
+    # only the labelled graphs are extracted by default
+    assert all(msg.startswith("Duplicate") for msg in errors.values())
+    assert len(keys) > 0
+    assert all(k.split("/")[1] in ("left", "right") for k in keys)
@@ -1,4 +1,5 @@
 from soma import aims
+import numpy as np
 import dico_toolbox as dtb
 import resources
 
@@ -13,3 +14,181 @@ def test_volume_to_mesh():
 
     except Exception as e:
         raise Exception(f"Error generating mesh: {str(e)}")
+
+
+def test_bucket_aims_to_ndarray():
+    bck = resources.data.bucket_example[0]
+    expected = np.array([p.arraydata() for p in bck.keys()])
+
+    arr = dtb.convert.bucket_aims_to_ndarray(bck)
+    assert arr.dtype == np.float64
+    assert np.array_equal(arr, expected)
+
+    arr = dtb.convert.bucket_aims_to_ndarray(
+        bck, voxel_size=(2, 2, 2), dtype=np.float32)
+    assert arr.dtype == np.float32
+    assert np.allclose(arr, 2*expected)
+
+    arr = dtb.convert.bucket_aims_to_ndarray(bck, dtype=np.int16)
+    assert arr.dtype == np.int16
+    assert np.array_equal(arr, expected)
+
+
+def test_bucket_aims_to_ndarray_bulk(monkeypatch):
+    # extract the keys of all the buckets through the volume Converter
+    monkeypatch.setattr(dtb.convert, "_BULK_KEYS_MIN_POINTS", 1)
+    bck = resources.data.bucket_example[0]
+    expected = np.array([p.arraydata() for p in bck.keys()])
+    assert np.array_equal(dtb.convert.bucket_aims_to_ndarray(bck), expected)
+
+    # negative coordinates are not in the converted volume
+    points = np.array([[-3, 0, 2], [1, 4, -5], [2, 2, 2]])
+    bck_map = dtb.convert.bucket_numpy_to_bucketMap_aims(points)
+    arr = dtb.convert.bucket_aims_to_ndarray(bck_map[0], dtype=int)
+    assert set(map(tuple, arr)) == set(map(tuple, points))
+
+
+def test_bucket_numpy_to_volume_numpy():
+    bucket = np.array([[0, 0, 0], [2, -1, 3], [5, 4, -2], [2, -1, 3]])
+    for dtype in [bool, np.uint8, np.int16, np.float64]:
+        vol, offset = dtb.convert.bucket_numpy_to_volume_numpy(
+            bucket, pad=1, dtype=dtype)
+        assert vol.dtype == dtype
+        assert np.array_equal(offset, [0, -1, -2])
+        assert vol.shape == (8, 8, 8)
+        assert vol.sum() == 3
+        for p in bucket:
+            assert vol[tuple(p - offset + 1)]
+
+
+def test_bucket_numpy_to_volume_numpy_tight():
+    bucket = np.array([[100, 120, 80], [102, 121, 83]])
+    vol, offset = dtb.convert.bucket_numpy_to_volume_numpy(
+        bucket, pad=2, dtype=np.uint8, tight=True)
+    assert np.array_equal(offset, [100, 120, 80])
+    assert vol.shape == (7, 6, 8)
+    assert vol.sum() == 2
+    for p in bucket:
+        assert vol[tuple(p - offset + 2)] == 1
+
+    vol, offset = dtb.convert.bucket_numpy_to_volume_numpy(bucket)
+    assert np.array_equal(offset, [0, 0, 0])
+    assert vol.shape == (103, 122, 84)
+
+
+def test_bucket_numpy_to_tight_volume_aims():
+    bucket = np.array([[100, 120, 80], [102, 121, 83]])
+    vol, offset = dtb.convert.bucket_numpy_to_tight_volume_aims(bucket, pad=2)
+    assert np.array_equal(offset, [100, 120, 80])
+    assert dtb.convert.volume_to_ndarray(vol).shape == (7, 6, 8)
+    assert dtb.convert.volume_to_ndarray(vol).sum() == 2
+
+
+def test_bucket_numpy_to_bucketMap_aims():
+    points = np.array([[0, 0, 0], [3, 1, 2], [5, 4, 7]])
+    for pts in [points, points - 2]:
+        bck_map = dtb.convert.bucket_numpy_to_bucketMap_aims(
+            pts, voxel_size=(2, 2, 3))
+        assert np.allclose(bck_map.header()['voxel_size'][:3], (2, 2, 3))
+        arr = dtb.convert.bucketMAP_aims_to_ndarray(bck_map, scaled=False)
+        assert set(map(tuple, arr.astype(int))) == set(map(tuple, pts))
+
+
+def test_bucket_numpy_to_bucketMap_aims_far_from_origin(monkeypatch):
+    bulk_calls = []
+    bulk = dtb.convert._bucketMap_aims_from_positive_ndarray
+
+    def spy(*args):
+        bulk_calls.append(args)
+        return bulk(*args)
+
+    monkeypatch.setattr(dtb.convert, "_bucketMap_aims_from_positive_ndarray", spy)
+    near = np.array([[0, 0, 0], [3, 1, 2], [5, 4, 7]])
+    # a few points near (1000,1000,1000) would need a volume of about 1e9 voxels
+    far = near + 1000
+    for pts, expect_bulk in [(near, True), (far, False), (near - 2, False)]:
+        bulk_calls.clear()
+        bck_map = dtb.convert.bucket_numpy_to_bucketMap_aims(pts)
+        assert len(bulk_calls) == int(expect_bulk)
+        arr = dtb.convert.bucketMAP_aims_to_ndarray(bck_map, scaled=False)
+        assert set(map(tuple, arr.astype(int))) == set(map(tuple, pts))
+
+
+def test_volume_to_mesh_low_memory():
+    bck = resources.data.bucket_example[0]
+    vol, _ = dtb.convert.bucket_aims_to_volume_numpy(bck)
+    mesh = dtb.convert.volume_to_mesh(vol)
+    lean_mesh = dtb.convert.volume_to_mesh(vol, low_memory=True)
+
+    vertices = np.array(mesh.vertex(0))
+    lean_vertices = np.array(lean_mesh.vertex(0))
+    assert np.allclose(vertices.min(axis=0), lean_vertices.min(axis=0), atol=1)
+    assert np.allclose(vertices.max(axis=0), lean_vertices.max(axis=0), atol=1)
+
+
+def test_low_memory_threshold_value():
+    rng = np.random.default_rng(0)
+    for i in range(200):
+        field = rng.random((20, 20, 20)).astype([np.float32, np.float64][i % 2])
+        field[field < 0.5] = 0
+        field /= field.max()
+        threshold = f"{rng.uniform(0, 100)}%"
+        expected = dtb.convert._threshold_value(field, threshold)
+        value = dtb.convert._threshold_value(field, threshold, low_memory=True)
+        assert np.int16(value*dtb.convert.MAX_VOXEL_VALUE) == np.int16(expected*dtb.convert.MAX_VOXEL_VALUE)
+
+
+def test_meshing_pipeline():
+    bck = resources.data.bucket_example[0]
+    vol, _ = dtb.convert.bucket_aims_to_volume_numpy(bck)
+    pipeline = dtb.convert.MeshingPipeline(vol)
+
+    mesh_1 = pipeline.mesh(smoothIt=10)
+    raw_mesh, _ = pipeline.raw_mesh()
+    mesh_2 = pipeline.mesh(smoothIt=50)
+    # the intermediate results are reused
+    assert pipeline.raw_mesh()[0] is raw_mesh
+    assert len(pipeline._blurred) == 1
+    assert mesh_1.vertex(0).size() > 0 and mesh_2.vertex(0).size() > 0
+
+
+def test_meshing_pipeline_without_smoothing_and_decimation():
+    bck = resources.data.bucket_example[0]
+    vol, _ = dtb.convert.bucket_aims_to_volume_numpy(bck)
+    pipeline = dtb.convert.MeshingPipeline(vol)
+
+    mesh = pipeline.mesh(smoothIt=None, deciReductionRate=None)
+    raw_mesh, offset = pipeline.raw_mesh()
+    assert np.allclose(np.array(mesh.vertex(0)), np.array(raw_mesh.vertex(0)) + offset)
+
+
+def test_volume_to_meshes_by_label():
+    vol = np.zeros((40, 30, 30), dtype=np.int16)
+    vol[5:12, 5:12, 5:12] = 1
+    vol[25:35, 10:20, 10:20] = 3
+    meshes = dtb.convert.volume_to_meshes_by_label(vol, n_jobs=2)
+    assert set(meshes.keys()) == {1, 3}
+    v1 = np.array(meshes[1].vertex(0))
+    v3 = np.array(meshes[3].vertex(0))
+    assert v1[:, 0].max() < 20 < v3[:, 0].min()
+
+    meshes = dtb.convert.volume_to_meshes_by_label(
+        vol, n_jobs=2, backend="numpy", threshold=0.5)
+    assert set(meshes.keys()) == {1, 3}
+    assert isinstance(meshes[1], dtb.wrappers.PyMesh)
+    assert meshes[1].vertices[:, 0].max() < 20 < meshes[3].vertices[:, 0].min()
+
+
+def test_volume_to_mesh_numpy_backend():
+    x, y, z = np.mgrid[:30, :30, :30]
+    vol = ((x-15)**2 + (y-15)**2 + (z-15)**2 < 8**2).astype(np.int16)
+    mesh = dtb.convert.volume_to_mesh(
+        vol, threshold=0.5, backend="numpy", translation=(1, 0, 0))
+    assert isinstance(mesh, dtb.wrappers.PyMesh)
+    assert mesh.polygons.shape[1] == 3
+    assert len(mesh.vertices) == len(mesh.normals)
+
+    radius = np.linalg.norm(mesh.vertices - (16, 15, 15), axis=1)
+    assert 6 < radius.min() and radius.max() < 9
+    # the normals point outward
+    assert np.all(np.sum(mesh.normals*(mesh.vertices - (16, 15, 15)), axis=1) > 0)
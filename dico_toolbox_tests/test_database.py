@@ -1,5 +1,6 @@
 
-from dico_toolbox.database import extend_templates
+import os.path as op
+from dico_toolbox.database import extend_templates, compile_template, iter_templates, BVDatabase
 from dico_toolbox import test_data
 
 
@@ -26,3 +27,85 @@ def test_database_with_templates():
         "morphologist_labelled_graph",
         subject=['001'], version='3.3', session="session1_manual", hemi=["L", "R"])
     assert len(fpaths) == 2
+
+
+def test_database_index(tmp_path):
+    root = test_data.bv_database().path
+    index_path = str(tmp_path / "index.json")
+    db = BVDatabase(root, index_path=index_path)
+    db.scan()
+    # the second database is loaded from the index, without scanning
+    db2 = BVDatabase(root, index_path=index_path)
+    assert db2.files == db.files
+    assert len(db2.get(subject='001')) == 26
+    db2.refresh()
+    assert sorted(db2.files) == sorted(db.files)
+
+
+def test_database_queries():
+    db = test_data.bv_database()
+    graphs = db.get(type="graph")
+    left = db.get(type="graph", hemisphere="left")
+    right = db.get(type="graph", hemisphere="right")
+    assert sorted(left + right) == sorted(db.get(type="graph", hemisphere=[]))
+    assert set(left) <= set(graphs)
+    assert len(db.get()) == len(db.files)
+    assert db.get_attribute_of(left[0])['hemisphere'] == "left"
+    assert db.list_all('hemisphere', type="graph", subject='001') in (["left", "right"], ["right", "left"])
+
+
+def test_database_parallel_scan():
+    root = test_data.bv_database().path
+    db = BVDatabase(root, n_jobs=4)
+    db.scan()
+    serial_db = BVDatabase(root, n_jobs=1)
+    serial_db.scan()
+    assert db.files == serial_db.files
+    assert db.files_attributes == serial_db.files_attributes
+
+
+def test_compile_template():
+    regex = compile_template("[center]/[subject]/t1mri/*/*/folds/3.3/[hemi][subject].arg", hemi=["L", "R"])
+    match = regex.fullmatch("c1/sub-01/t1mri/acq/ana/folds/3.3/Lsub-01.arg")
+    assert match.groupdict() == {'center': 'c1', 'subject': 'sub-01', 'hemi': 'L'}
+    assert regex.fullmatch("c1/sub-01/t1mri/acq/ana/folds/3.3/Lsub-02.arg") is None
+    assert regex.fullmatch("c1/sub-01/t1mri/acq/ana/folds/3.3/Xsub-01.arg") is None
+    assert list(iter_templates("[subject]/[hemi].arg", subject=["1", "2"], hemi="L")) == ["1/L.arg", "2/L.arg"]
+
+
+def test_find_from_template():
+    db = test_data.bv_database()
+    found = db.find_from_template(
+        "morphologist_labelled_graph",
+        subject=['001'], version='3.3', session="session1_manual", hemi=["L", "R"])
+    assert sorted(attributes['hemi'] for _, attributes in found) == ["L", "R"]
+    assert sorted(db.find_from_template("morphologist_labelled_graph", use_index=True, subject='001',
+                                        version='3.3', session="session1_manual")) == sorted(found)
+
+
+def _touch(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+
+
+def test_unlabelled_graph_hemisphere(tmp_path):
+    acq = tmp_path / "center" / "001" / "t1mri" / "acq"
+    _touch(acq / "001.nii.gz")
+    _touch(acq / "ana" / "folds" / "3.3" / "L001.arg")
+    _touch(acq / "ana" / "folds" / "3.3" / "session1_manual" / "L001_session1_manual.arg")
+    db = BVDatabase(str(tmp_path))
+    graphs = db.get(type="graph", hemisphere="left")
+    assert sorted(op.basename(p) for p in graphs) == ["L001.arg", "L001_session1_manual.arg"]
+    unlabelled = db.get_attribute_of(str(acq / "ana" / "folds" / "3.3" / "L001.arg"))
+    assert unlabelled['hemisphere'] == "left"
+    assert 'graph_session' not in unlabelled
+
+
+def test_sidecar_files_are_ignored(tmp_path):
+    folds = tmp_path / "center" / "001" / "t1mri" / "acq" / "ana" / "folds" / "3.3"
+    _touch(tmp_path / "center" / "001" / "t1mri" / "acq" / "001.nii.gz")
+    _touch(folds / "R001.arg")
+    _touch(folds / "R001.arg.dtb.npz")
+    db = BVDatabase(str(tmp_path))
+    assert [op.basename(p) for p in db.get(hemisphere="right")] == ["R001.arg"]
+    assert not any(p.endswith(".dtb.npz") for p in db.files)
@@ -1,6 +1,111 @@
+import numpy as np
+from soma import aims
 import dico_toolbox as dtb
 
 
 def test_list_buckets():
     graph_path = dtb.test_data.bv_database().get(type="graph")[0]
     buckets = dtb.graph.list_buckets(graph_path, transform="Talairach")
+
+
+def test_columnar_buckets():
+    graph_path = dtb.test_data.bv_database().get(type="graph")[0]
+    buckets, names = dtb.graph.list_buckets(graph_path, return_keys='name')
+    cb = dtb.graph.columnar_buckets(graph_path, return_keys='name')
+    assert len(cb) == len(buckets)
+    assert list(cb.columns['name']) == names
+    for b, expected in zip(cb, buckets):
+        assert np.array_equal(b, expected)
+
+
+def test_list_buckets_transform():
+    graph_path = dtb.test_data.bv_database().get(type="graph")[0]
+    graph = aims.read(graph_path)
+    tr = dtb.graph.SPACES_TRANSFORMERS["Talairach"](graph)
+
+    buckets, _ = dtb.graph.list_buckets(graph)
+    tr_buckets, _ = dtb.graph.list_buckets(graph, transform="Talairach")
+    assert len(buckets) == len(tr_buckets)
+    for b, tb in zip(buckets, tr_buckets):
+        assert np.allclose(tr.transformPoints(b), tb, atol=1e-4)
+
+    # the matrix is computed once per graph
+    matrix = dtb.graph.get_space_matrix(graph, "Talairach")
+    assert dtb.graph.get_space_matrix(graph, "Talairach") is matrix
+
+
+def test_graph_index():
+    graph_path = dtb.test_data.bv_database().get(type="graph")[0]
+    graph = aims.read(graph_path)
+    index = dtb.graph.GraphIndex(graph, keys=['name'])
+    assert len(index) == len(graph.vertices().list())
+
+    names = dtb.graph.get_property_from_vertices(graph, 'name')
+    assert dtb.graph.get_property_from_vertices(index, 'name') == names
+
+    name = names[0]
+    expected = dtb.graph.get_vertices_by_key(graph, 'name', [name])
+    vertices = dtb.graph.get_vertices_by_key(index, 'name', [name])
+    assert len(vertices) == len(expected)
+    assert all(v['name'] == name for v in vertices)
+
+    buckets, _ = dtb.graph.list_buckets(graph, 'name', name)
+    index_buckets, _ = dtb.graph.list_buckets(index, 'name', name)
+    assert len(buckets) == len(index_buckets)
+
+    assert len(index.column('point_number')) == len(index)
+
+
+def test_graph_cache():
+    graph_path = dtb.test_data.bv_database().get(type="graph")[0]
+    dtb.graph.enable_graph_cache(2)
+    try:
+        dtb.graph.GRAPH_CACHE.invalidate()
+        hits = dtb.graph.GRAPH_CACHE.hits
+        dtb.graph.list_buckets(graph_path)
+        dtb.graph.get_property_from_vertices(graph_path, 'name')
+        assert dtb.graph.GRAPH_CACHE.hits == hits + 1
+        assert dtb.graph.GRAPH_CACHE.info()['size'] == 1
+
+        dtb.graph.GRAPH_CACHE.invalidate(graph_path)
+        assert dtb.graph.GRAPH_CACHE.info()['size'] == 0
+    finally:
+        dtb.graph.enable_graph_cache(0)
+
+
+def test_read_arg_metadata(tmp_path):
+    arg_path = tmp_path / "Lsubject.arg"
+    arg_path.write_text("# graph 1.0\n\n*BEGIN GRAPH CorticalFoldArg\nvoxel_size 2 2 2.5\n\n"
+                        "*BEGIN NODE fold 12\nname S.C._left\npoint_number 345\n*END\n\n"
+                        "*BEGIN NODE fold 40\nname unknown\n*END\n\n"
+                        "*BEGIN RELATION junction 40 12\nsize 12.5\n*END\n\n*END\n")
+    meta = dtb.graph.read_arg_metadata(str(arg_path))
+    assert meta['syntax'] == 'CorticalFoldArg'
+    assert meta['attributes']['voxel_size'] == [2, 2, 2.5]
+    assert [v['name'] for v in meta['vertices']] == ['S.C._left', 'unknown']
+    assert meta['edges'] == [{'size': 12.5}]
+    assert meta['edge_vertices'].tolist() == [[1, 0]]
+    assert dtb.graph.arg_vertex_column(meta, 'point_number', 0).tolist() == [345, 0]
+
+
+def test_edge_table_and_adjacency():
+    graph_path = dtb.test_data.bv_database().get(type="graph")[0]
+    index = dtb.graph.GraphIndex(graph_path)
+    edges = dtb.graph.edge_table(index)
+    n_edges = index.graph.edges().size()
+    assert len(edges['source']) == len(edges['target']) == len(edges['syntax']) == n_edges
+    adjacency = dtb.graph.adjacency_matrix(index, edges=edges)
+    assert adjacency.shape == (len(index), len(index))
+    assert adjacency.sum() == 2 * n_edges
+    assert (adjacency != adjacency.T).nnz == 0
+
+
+def test_label_volume():
+    graph_path = dtb.test_data.bv_database().get(type="graph")[0]
+    vol, offset, labels = dtb.graph.label_volume(graph_path, 'name')
+    cb = dtb.graph.columnar_buckets(graph_path, 'name', return_keys='name')
+    assert set(np.unique(vol)) - {0} <= set(labels.values())
+    voxel_size = np.array(aims.read(graph_path)['voxel_size'][:3])
+    point = cb[0][0]
+    voxel = np.round(point / voxel_size).astype(int) - offset
+    assert vol[tuple(voxel)] > 0
@@ -0,0 +1,17 @@
+import dico_toolbox as dtb
+from dico_toolbox.loader import prefetch_load
+
+
+def test_prefetch_load_order():
+    paths = [f"file_{i}" for i in range(10)]
+    loaded = list(prefetch_load(paths, loader=str.upper, prefetch=3))
+    assert [l.path for l in loaded] == paths
+    assert [l.data for l in loaded] == [p.upper() for p in paths]
+    assert all(l.load_time >= 0 for l in loaded)
+
+
+def test_prefetch_load_database():
+    db = dtb.test_data.bv_database()
+    loaded = list(prefetch_load(db, numpy=True, type="graph"))
+    assert len(loaded) == len(db.get(type="graph"))
+    assert all(len(l.data) > 0 for l in loaded)
@@ -0,0 +1,24 @@
+import numpy as np
+import dico_toolbox as dtb
+
+
+def _sphere_mesh(smoothIt=0):
+    x, y, z = np.mgrid[:30, :30, :30]
+    vol = ((x-15)**2 + (y-15)**2 + (z-15)**2 < 8**2).astype(np.int16)
+    return dtb.convert.volume_to_mesh(vol, threshold=0.5, backend="numpy", smoothIt=smoothIt)
+
+
+def test_smooth_pymesh():
+    mesh = _sphere_mesh()
+    smoothed = dtb.mesh.smooth_pymesh(mesh, iterations=10, rate=0.4)
+    assert np.allclose(smoothed.vertices, _sphere_mesh(smoothIt=10).vertices)
+    assert smoothed.polygons is mesh.polygons
+    # the input is not modified
+    assert np.allclose(mesh.vertices, _sphere_mesh().vertices)
+
+    batch = dtb.mesh.smooth_pymesh([mesh, smoothed], iterations=10, rate=0.4)
+    assert len(batch) == 2
+    assert np.allclose(batch[0].vertices, smoothed.vertices)
+
+    smoother = dtb.mesh.LaplacianSmoother(mesh.polygons)
+    assert np.allclose(smoother(mesh.vertices, 10, 0.4), smoothed.vertices)
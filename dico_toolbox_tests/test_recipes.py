@@ -0,0 +1,106 @@
+import logging
+import numpy as np
+from soma import aims
+from dico_toolbox.wrappers import PyMesh
+from dico_toolbox.recipes.meshes import (_pack_point_clouds, _split_packed_mesh,
+                                         mesh_one_point_cloud, mesh_packed_point_clouds)
+
+
+def cube(corner, size):
+    grid = np.mgrid[0:size, 0:size, 0:size].reshape(3, -1).T
+    return grid + np.array(corner)
+
+
+POINT_CLOUDS = {
+    "a": cube((10, 20, 30), 4),
+    "b": cube((-50, 0, 5), 3),
+    "c": cube((0, 100, -20), 5),
+}
+
+
+def point_cloud_data(name, pc, talairach=None, flip=False, **meshing_parameters):
+    return dict(name=name, pc=pc, talairach=talairach, flip=flip, align=None,
+                meshing_parameters=meshing_parameters)
+
+
+def packed_data(names, pcs, **meshing_parameters):
+    return dict(names=names, pcs=pcs, talairach=None, flip=False, align=None,
+                meshing_parameters=meshing_parameters)
+
+
+def bounding_box(vertices):
+    vertices = np.asarray(vertices)
+    return np.concatenate([vertices.min(axis=0), vertices.max(axis=0)])
+
+
+def test_pack_point_clouds():
+    pcs = list(POINT_CLOUDS.values())
+    spacing = 5
+    packed, shifts, starts = _pack_point_clouds(pcs, spacing)
+    assert len(packed) == sum(len(pc) for pc in pcs)
+    counts = np.cumsum([0] + [len(pc) for pc in pcs])
+    for i, pc in enumerate(pcs):
+        piece = packed[counts[i]:counts[i+1]]
+        # the shift brings the packed point cloud back to its position
+        assert np.array_equal(piece + shifts[i], pc)
+        assert piece[:, 0].min() == starts[i]
+        if i > 0:
+            # the point clouds are separated by spacing empty voxels
+            assert piece[:, 0].min() - packed[counts[i-1]:counts[i], 0].max() == spacing + 1
+
+
+def test_split_packed_mesh():
+    mesh = PyMesh()
+    # one triangle at x~0, none at x~10, one at x~20
+    vertices = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0],
+                         [20, 0, 0], [21, 0, 0], [20, 1, 0]], dtype=float)
+    polygons = np.array([[3, 4, 5], [0, 1, 2]])
+    mesh.from_elements(vertices, polygons, None)
+    pieces = list(_split_packed_mesh(mesh, starts=np.array([0, 10, 20]), spacing=4))
+    assert [i for i, _, _ in pieces] == [0, 2]
+    for i, piece_vertices, piece_polygons in pieces:
+        assert len(piece_vertices) == 3
+        assert np.array_equal(piece_polygons, [[0, 1, 2]])
+        assert piece_vertices[:, 0].min() == 10*i
+
+
+def test_mesh_packed_point_clouds():
+    parameters = dict(gblur_sigma=0, threshold=0.5)
+    names = list(POINT_CLOUDS)
+    packed = mesh_packed_point_clouds(
+        packed_data(names, list(POINT_CLOUDS.values()), **parameters))
+    assert [r['name'] for r in packed] == names
+
+    for result in packed:
+        name = result['name']
+        separate = mesh_one_point_cloud(
+            point_cloud_data(name, POINT_CLOUDS[name], **parameters))
+        assert len(result['mesh']['polygons']) > 0
+        assert np.allclose(bounding_box(result['mesh']['vertices']),
+                           bounding_box(separate['mesh']['vertices']), atol=0.1)
+
+
+def test_mesh_packed_point_clouds_empty_piece(caplog):
+    # once blurred, the single voxel is far below the threshold normalized on the big cube
+    pcs = [cube((0, 0, 0), 6), np.array([[40, 0, 0]])]
+    with caplog.at_level(logging.WARNING):
+        results = mesh_packed_point_clouds(
+            packed_data(["cube", "voxel"], pcs, gblur_sigma=1, threshold=0.5))
+    assert [r['name'] for r in results] == ["cube"]
+    assert "1 point-cloud(s) have an empty mesh" in caplog.text
+
+
+def test_mesh_one_point_cloud_transformations():
+    pc = POINT_CLOUDS["a"]
+    reference = bounding_box(mesh_one_point_cloud(
+        point_cloud_data("a", pc, gblur_sigma=0, threshold=0.5))['mesh']['vertices'])
+
+    talairach = dict(dxyz=np.ones(3), rot=np.eye(3), tra=np.array([10., 0, 0]))
+    moved = bounding_box(mesh_one_point_cloud(
+        point_cloud_data("a", pc, talairach=talairach, gblur_sigma=0, threshold=0.5))['mesh']['vertices'])
+    assert np.allclose(moved, reference + [10, 0, 0, 10, 0, 0], atol=1e-4)
+
+    flipped = bounding_box(mesh_one_point_cloud(
+        point_cloud_data("a", pc, flip=True, gblur_sigma=0, threshold=0.5))['mesh']['vertices'])
+    assert np.allclose(flipped[[0, 3]], -reference[[3, 0]], atol=1e-4)
+    assert np.allclose(flipped[[1, 2, 4, 5]], reference[[1, 2, 4, 5]], atol=1e-4)
@@ -0,0 +1,37 @@
+import os
+import numpy as np
+import dico_toolbox as dtb
+from dico_toolbox.sidecar import _memmap_npz
+
+
+def test_memmap_npz(tmp_path):
+    path = os.path.join(tmp_path, "arrays.npz")
+    a = np.arange(12, dtype=np.int16).reshape(4, 3)
+    np.savez(path, a=a, b=np.array(["x", "yz"]), empty=np.empty((0, 3)))
+    arrays = _memmap_npz(path)
+    assert np.array_equal(arrays["a"], a)
+    assert list(arrays["b"]) == ["x", "yz"]
+    assert arrays["empty"].shape == (0, 3)
+
+
+def test_sidecar_path(tmp_path):
+    arg_path = os.path.realpath(os.path.join(tmp_path, "L001.arg"))
+    assert dtb.sidecar.sidecar_path(arg_path).startswith(dtb.sidecar.DEFAULT_CACHE_DIR)
+    assert dtb.sidecar.sidecar_path(arg_path, cache_dir=tmp_path).startswith(str(tmp_path) + os.sep)
+    assert dtb.sidecar.sidecar_path(arg_path, next_to_graph=True) == arg_path + ".dtb.npz"
+    # the sidecars are not listed by the databases
+    assert dtb.sidecar.SIDECAR_EXTENSION in dtb.database.IGNORED_SUFFIXES
+
+
+def test_read_graph_sidecar(tmp_path):
+    graph_path = dtb.test_data.bv_database().get(type="graph")[0]
+    sc = dtb.sidecar.read_graph_sidecar(graph_path, cache_dir=tmp_path)
+    assert sc.is_valid(graph_path)
+    names = sc.vertices['name']
+    buckets = sc.buckets()
+    assert len(buckets) == len(names) == len(sc)
+    index = dtb.graph.GraphIndex(graph_path)
+    stacks = [dtb.graph.stack_vertex_buckets(v) for v in index.vertices]
+    assert len(buckets.points) == sum(len(s) for s in stacks if s is not None)
+    # the sidecar is reused
+    assert dtb.sidecar.read_graph_sidecar(graph_path, cache_dir=tmp_path).path == sc.path
@@ -0,0 +1,14 @@
+from soma import aims
+import dico_toolbox as dtb
+from dico_toolbox.wrappers import pyGraph
+
+
+def test_pygraph():
+    graph_path = dtb.test_data.bv_database().get(type="graph")[0]
+    graph = pyGraph(aims.read(graph_path))
+    assert len(graph.vertices) == len(graph.aimsvertices)
+    vertex = graph.vertices[0]
+    assert vertex.name == vertex.to_aims().get('name')
+    assert 'name' in vertex.keys()
+    # attributes and methods of the aims graph
+    assert list(graph.voxel_size) == list(graph.to_aims()['voxel_size'])